@@ -3,6 +3,9 @@ ASGI config for api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live listings feed (vehicle/live/) streams its events from here, it isn't available through
+the WSGI application.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
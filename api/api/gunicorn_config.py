@@ -0,0 +1,70 @@
+"""
+Gunicorn Configuration
+======================
+
+The production server: gunicorn -c python:api.gunicorn_config, or manage.py serve which runs the same.
+
+The app is imported once in the master process (preload_app), warmed up by the WARMUP_HOOKS, then forked
+into the workers, which share it copy-on-write. Every worker runs the WORKER_HOOKS right after the fork,
+e.g. to open its own database connections. SIGTERM stops the workers gracefully, gunicorn lets them
+finish their requests within graceful_timeout.
+"""
+
+from django.db import connections
+from api.warmup import run_warmup_hooks, run_worker_hooks
+from time import perf_counter
+import gc
+import os
+
+STARTED = perf_counter()
+
+wsgi_app = "api.wsgi:application"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def memory_usage(pid):
+    """
+    Return the (RSS, PSS) of a process in kB. PSS splits shared pages between the processes sharing them,
+    so it shows what copy-on-write saves. None where /proc isn't available.
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    usage[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage.get('Rss'), usage.get('Pss')
+
+
+def when_ready(server):
+    # The app is loaded, the workers aren't forked yet
+    for name, elapsed in run_warmup_hooks():
+        server.log.info(f"Ran warmup hook {name} in {elapsed * 1000:.1f} ms")
+
+    # Database connections can't be shared between processes, every worker opens its own
+    connections.close_all()
+
+    # Keep the preloaded objects out of the garbage collector, its bookkeeping would otherwise
+    # write to their pages in every worker and undo the copy-on-write sharing
+    gc.freeze()
+    server.log.info(f"Started in {(perf_counter() - STARTED) * 1000:.1f} ms")
+
+
+def post_fork(server, worker):
+    run_worker_hooks()
+
+
+def post_worker_init(worker):
+    rss, pss = memory_usage(worker.pid)
+    if rss is None:
+        worker.log.info(f"Worker {worker.pid}: memory usage not available")
+    else:
+        worker.log.info(f"Worker {worker.pid}: RSS {rss / 1024:.1f} MB, PSS {pss / 1024:.1f} MB")
+
+
+def worker_exit(server, worker):
+    connections.close_all()
@@ -0,0 +1,129 @@
+"""
+Media Serving
+=============
+
+Serves the uploaded media with HTTP caching and range support. Content addressed files (named after
+their SHA-256, see vehicle/storage.py) never change, so they get an immutable one year Cache-Control
+and their hash as a strong ETag. Other files are revalidated with an ETag built from mtime and size.
+
+Whole files are returned with FileResponse, which servers implementing wsgi.file_wrapper send with
+sendfile(). With MEDIA_SENDFILE_HEADER set (e.g. "X-Accel-Redirect" for nginx, "X-Sendfile" for Apache)
+the transfer, ranges included, is handed off to the front server entirely.
+"""
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from vehicle.storage import CONTENT_HASH_NAME
+import mimetypes
+import os
+import re
+import stat
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+RANGE_CHUNK_SIZE = 64 * 1024
+BYTE_RANGE = re.compile(r'bytes=(\d*)-(\d*)', re.IGNORECASE)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) of a single byte range, end included. None if the header isn't a single,
+    well-formed range: unsupported Range headers are ignored and the whole file is sent. Raises
+    RangeNotSatisfiable for a range starting past the end of the file.
+    """
+    match = BYTE_RANGE.fullmatch(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise RangeNotSatisfiable
+        return start, min(int(last), size - 1) if last else size - 1
+
+    # Suffix range, the last N bytes
+    if int(last) == 0 or size == 0:
+        raise RangeNotSatisfiable
+    return max(size - int(last), 0), size - 1
+
+
+def etag_matches(etag, header):
+    """Weak comparison of If-None-Match, W/"x" matches "x"."""
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [tag.removeprefix('W/') for tag in tags]
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("File not found.")
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404("File not found.")
+
+    name = os.path.basename(full_path)
+    if CONTENT_HASH_NAME.fullmatch(name):
+        etag = f'"{os.path.splitext(name)[0]}"'
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+        cache_control = REVALIDATE_CACHE_CONTROL
+
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Accept-Ranges': 'bytes',
+               'Last-Modified': http_date(file_stat.st_mtime)}
+
+    if etag_matches(etag, request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if settings.MEDIA_SENDFILE_HEADER:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response[settings.MEDIA_SENDFILE_HEADER] = settings.MEDIA_SENDFILE_PREFIX + path
+        return response
+
+    # A range only applies if the client's copy is still the current one (strong comparison)
+    range_header = request.headers.get('Range')
+    byte_range = None
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, file_stat.st_size)
+        except RangeNotSatisfiable:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{file_stat.st_size}'})
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(full_path, start, end - start + 1), status=206,
+                                         content_type=content_type, headers=headers)
+        response['Content-Range'] = f'bytes {start}-{end}/{file_stat.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+    return FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
@@ -0,0 +1,140 @@
+"""
+Request Profiling
+=================
+
+Opt-in profiling of live requests. With PROFILING_ENABLED, a request is profiled when an admin sends the
+X-Profile header, or at random with the PROFILING_SAMPLE_RATE probability. Every capture is written to
+PROFILING_DIR, tagged with the URL name, and only the newest PROFILING_MAX_FILES captures are kept.
+The profile_report command aggregates them.
+
+Two modes are available through PROFILING_MODE:
+- "cprofile" records every function call with cProfile (.prof files, exact but slower)
+- "sample" samples the request thread's stack every PROFILING_SAMPLE_INTERVAL seconds
+  (.collapsed files with full stacks, low overhead)
+"""
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from collections import Counter
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+
+class CProfileCapture:
+    extension = '.prof'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def save(self, path):
+        self.profiler.dump_stats(path)
+
+
+class StackSampler:
+    extension = '.collapsed'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.sampler.join()
+
+    def save(self, path):
+        # Flamegraph "collapsed stacks" format: root;...;leaf count
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.items():
+                output.write(f"{stack} {count}\n")
+
+
+def is_admin(request):
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+def rotate_captures(directory, max_files):
+    # Workers rotate the same directory, a capture can disappear between listing and removing it
+    captures = []
+    for entry in os.scandir(directory):
+        try:
+            captures.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+    captures.sort()
+    for _, path in captures[:max(len(captures) - max_files, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILING_ENABLED or not self.should_profile(request):
+            return self.get_response(request)
+
+        if settings.PROFILING_MODE == 'sample':
+            capture = StackSampler(settings.PROFILING_SAMPLE_INTERVAL)
+        else:
+            capture = CProfileCapture()
+
+        capture.start()
+        try:
+            return self.get_response(request)
+        finally:
+            capture.stop()
+            self.save(request, capture)
+
+    def should_profile(self, request):
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            return True
+        return 'X-Profile' in request.headers and is_admin(request)
+
+    def save(self, request, capture):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        tag = re.sub(r'[^\w-]', '_', url_name or 'unresolved')
+
+        filename = f"{tag}-{time.time_ns()}-{os.getpid()}{capture.extension}"
+        # Runs after the response is built, a failing capture must never turn it into an error
+        try:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            capture.save(os.path.join(settings.PROFILING_DIR, filename))
+            rotate_captures(settings.PROFILING_DIR, settings.PROFILING_MAX_FILES)
+        except OSError:
+            pass
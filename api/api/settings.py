@@ -48,10 +48,45 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
-    ]
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.AnonTokenBucketThrottle',
+        'api.throttling.UserTokenBucketThrottle',
+        'api.throttling.ScopedTokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '300/min',
+        'user': '1000/min',
+        # Per route limits, see api/throttling.py
+        'login': '10/min',
+        'search': '120/min',
+        'vehicles': '120/min',
+    },
+    # Reverse proxies in front of the app. With 0 the throttles key on REMOTE_ADDR and ignore the
+    # client controlled X-Forwarded-For, set the number of trusted proxies when deployed behind them.
+    'NUM_PROXIES': 0,
 }
 
+# Shared by all worker processes when a Redis URL is given, otherwise every process has its own memory cache
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+
+# Vehicle details are only cached when the cache is shared, a process can't invalidate another's memory
+VEHICLE_DETAIL_CACHE = bool(REDIS_URL)
+
+# Token buckets of the throttles, shared by all worker processes on the host through this file when a path
+# is given, otherwise every process keeps its own buckets
+THROTTLE_STORE_PATH = os.environ.get("THROTTLE_STORE_PATH")
+THROTTLE_STORE_SLOTS = 65536
+
 MIDDLEWARE = [
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,6 +117,16 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "api.wsgi.application"
 
+# Run by gunicorn before it forks its workers, see api/gunicorn_config.py and api/warmup.py
+WARMUP_HOOKS = [
+    "api.warmup.compile_url_patterns",
+    "vehicle.catalog.prime_catalog_cache",
+]
+# Run by every gunicorn worker right after the fork
+WORKER_HOOKS = [
+    "api.warmup.open_database_connections",
+]
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -90,6 +135,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Kept between requests, so the connection a worker opens after the fork is reused
+        "CONN_MAX_AGE": 60,
     }
 }
 
@@ -133,6 +180,17 @@ STATIC_URL = "static/"
 MEDIA_URL = "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Django's default upload handlers, extended to hash uploads while they stream in
+FILE_UPLOAD_HANDLERS = [
+    "vehicle.storage.HashingMemoryFileUploadHandler",
+    "vehicle.storage.HashingTemporaryFileUploadHandler",
+]
+
+# Hand media transfers off to the front server, e.g. "X-Accel-Redirect" with an internal nginx
+# location as prefix, or "X-Sendfile" for Apache. None serves the files from Django.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_SENDFILE_PREFIX = "/protected-media/"
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -143,3 +201,20 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
+
+# Number of days the vehicle change feed keeps its entries (see the compact_changes command),
+# clients with an older cursor have to do a full resync
+CHANGE_LOG_RETENTION_DAYS = 30
+
+# Live listings feed (vehicle/live/, ASGI only), see vehicle/live.py
+LIVE_BUFFER_SIZE = 100
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_MAX_CLIENTS = 10000
+
+# Opt-in request profiling, see api/profiling.py and the profile_report command
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_MODE = "cprofile"
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_DIR = os.path.join(BASE_DIR, "profiles")
+PROFILING_MAX_FILES = 200
@@ -0,0 +1,190 @@
+"""
+Rate Limiting
+=============
+
+Token bucket throttles for Django REST framework. The buckets live in a memory mapped file, so all
+worker processes on a host share them without a network service, and a request costs one hash,
+one file lock and a handful of slot reads.
+
+The store is a fixed size open addressing table of (key hash, tokens, last update) slots. When all
+slots a key can probe are taken, the least recently used one is reused, which only ever makes the
+throttle more lenient for the evicted client.
+"""
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle, SimpleRateThrottle
+from hashlib import blake2b
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, the buckets are then only shared between the threads of a process
+    fcntl = None
+
+
+SLOT = struct.Struct('<Qdd')
+PROBES = 8
+
+
+class BucketStore:
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.size = slots * SLOT.size
+        self.thread_lock = threading.Lock()
+        self.pid = None
+
+    def open(self):
+        # A forked worker must not reuse its parent's descriptor, flock() wouldn't exclude them
+        if self.pid == os.getpid():
+            return
+        if self.path is None:
+            self.fd = None
+            self.map = mmap.mmap(-1, self.size)
+        else:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self.fd).st_size < self.size:
+                os.ftruncate(self.fd, self.size)
+            self.map = mmap.mmap(self.fd, self.size)
+        self.pid = os.getpid()
+
+    def consume(self, key, capacity, refill_rate):
+        """Take a token from the key's bucket. Returns 0 if allowed, otherwise the seconds to wait."""
+        key_hash = int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        start = key_hash % self.slots
+
+        with self.thread_lock:
+            self.open()
+            if self.fd is not None and fcntl:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                offset, tokens, updated = self.find_slot(key_hash, start)
+                if offset is None:
+                    offset, tokens, updated = self.victim_slot(start), capacity, now
+
+                tokens = min(capacity, tokens + max(now - updated, 0) * refill_rate)
+                if tokens >= 1:
+                    tokens, wait = tokens - 1, 0
+                else:
+                    wait = (1 - tokens) / refill_rate
+                SLOT.pack_into(self.map, offset, key_hash, tokens, now)
+                return wait
+            finally:
+                if self.fd is not None and fcntl:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def find_slot(self, key_hash, start):
+        for i in range(PROBES):
+            offset = (start + i) % self.slots * SLOT.size
+            slot_hash, tokens, updated = SLOT.unpack_from(self.map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            # Slots are never emptied, so the key can't be stored past an empty one
+            if slot_hash == 0:
+                break
+        return None, None, None
+
+    def victim_slot(self, start):
+        """Return the first empty slot of the probe sequence, else the least recently updated one."""
+        victim, oldest = None, None
+        for i in range(PROBES):
+            offset = (start + i) % self.slots * SLOT.size
+            slot_hash, _, updated = SLOT.unpack_from(self.map, offset)
+            if slot_hash == 0:
+                return offset
+            if oldest is None or updated < oldest:
+                victim, oldest = offset, updated
+        return victim
+
+
+_stores = {}
+
+
+def bucket_store():
+    """Return the store configured by THROTTLE_STORE_PATH (None keeps the buckets in this process)."""
+    path = settings.THROTTLE_STORE_PATH
+    if path not in _stores:
+        _stores[path] = BucketStore(path, settings.THROTTLE_STORE_SLOTS)
+    return _stores[path]
+
+
+def reset_bucket_stores():
+    """Forget the opened stores, in-process buckets start full again (used by the tests)."""
+    _stores.clear()
+
+
+class TokenBucketMixin:
+    """
+    Replaces the cache based request history of SimpleRateThrottle with a token bucket, a rate of
+    "10/min" allows bursts of 10 requests and refills one token every 6 seconds.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        self.wait_time = bucket_store().consume(key, self.num_requests, self.num_requests / self.duration)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class AnonTokenBucketThrottle(TokenBucketMixin, AnonRateThrottle):
+    """Limits unauthenticated requests per IP address, uses the 'anon' rate."""
+
+
+class UserTokenBucketThrottle(TokenBucketMixin, UserRateThrottle):
+    """Limits requests per authenticated user (token), or per IP address otherwise, uses the 'user' rate."""
+
+
+class ScopedTokenBucketThrottle(TokenBucketMixin, SimpleRateThrottle):
+    """
+    Per route limits for every client. The scope comes from the view's throttle_scope attribute, or from
+    the class itself for function based views, which can't carry one.
+    """
+    scope = None
+
+    def __init__(self):
+        # The rate depends on the view, it's resolved in allow_request
+        pass
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, 'throttle_scope', None) or type(self).scope
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class LoginThrottle(ScopedTokenBucketThrottle):
+    scope = 'login'
+
+
+class SearchThrottle(ScopedTokenBucketThrottle):
+    scope = 'search'
+
+
+def throttles_with(*throttles):
+    """Default throttle classes plus the given ones, for the throttle_classes decorator."""
+    return [*api_settings.DEFAULT_THROTTLE_CLASSES, *throttles]
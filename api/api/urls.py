@@ -16,12 +16,15 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 from django.conf import settings
+from .media import serve_media
+import re
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('user/', include('user.urls')),
     path('vehicle/', include('vehicle.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Media with caching headers and range support, see api/media.py
+    re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.+)$", serve_media, name="Media"),
+]
@@ -0,0 +1,53 @@
+"""
+Warmup
+======
+
+Hooks gunicorn runs once in its master process before forking the workers (see api/gunicorn_config.py,
+also used by the serve command), so the work they do is shared copy-on-write instead of being paid by
+the first requests of every worker. The hooks are registered as dotted paths in the WARMUP_HOOKS setting.
+
+What can't be shared, like database connections, is set up by the WORKER_HOOKS in every worker right
+after the fork.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver, URLResolver
+from django.utils.module_loading import import_string
+from time import perf_counter
+
+
+def compile_url_patterns(patterns=None):
+    """Compile the regular expression of every URL pattern, they are otherwise compiled on first use."""
+    if patterns is None:
+        resolver = get_resolver()
+        # Accessing the reverse dict populates the resolver's lookup tables
+        resolver.reverse_dict
+        patterns = resolver.url_patterns
+
+    for pattern in patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compile_url_patterns(pattern.url_patterns)
+
+
+def open_database_connections():
+    """Open (and check) every database connection of this process, a worker hook."""
+    for connection in connections.all():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+
+def run_warmup_hooks():
+    """Run the WARMUP_HOOKS in order, yielding the name and duration of every hook."""
+    for path in settings.WARMUP_HOOKS:
+        hook = import_string(path)
+        start = perf_counter()
+        hook()
+        yield path, perf_counter() - start
+
+
+def run_worker_hooks():
+    """Run the WORKER_HOOKS in order, in a freshly forked worker."""
+    for path in settings.WORKER_HOOKS:
+        import_string(path)()
@@ -36,3 +36,17 @@ class UserSerializer(serializers.ModelSerializer):
         if len(value) < 8:  # Minimum length requirement for password
             raise serializers.ValidationError("Password must be at least 8 characters long.")
         return value
+
+
+class SellerSerializer(serializers.ModelSerializer):
+    # Aggregates annotated on the queryset by the seller directory
+    active_listings = serializers.IntegerField(read_only=True)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    avg_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    newest_listing = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'active_listings',
+                  'min_price', 'max_price', 'avg_price', 'newest_listing']
@@ -3,6 +3,11 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from rest_framework import status
 from django.urls import reverse
+from django.core.cache import cache
+from vehicle.models import Vehicle
+from api.throttling import BucketStore, LoginThrottle, reset_bucket_stores
+from unittest import mock
+import os, tempfile
 
 
 class UserTests(APITestCase):
@@ -63,6 +68,55 @@ class UserTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+class SellerDirectoryTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="user1", password="password123")
+        self.user2 = User.objects.create_user(username="user2", password="password123")
+        # Only user1 and user3 are sellers
+        self.user3 = User.objects.create_user(username="user3", password="password123")
+        for owner, price in [(self.user1, 10000), (self.user1, 20000), (self.user3, 50000)]:
+            Vehicle.objects.create(owner=owner, make='AUDI', model='A4', year=2016, price=price, mileage=60000,
+                                   color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+        self.client.force_authenticate(user=self.user2)
+
+    def test_get_sellers(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('SellerList'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+        seller = response.data['results'][0]
+        self.assertEqual(seller['id'], self.user1.pk)
+        self.assertEqual(seller['active_listings'], 2)
+        self.assertEqual(seller['min_price'], '10000.00')
+        self.assertEqual(seller['max_price'], '20000.00')
+        self.assertEqual(seller['avg_price'], '15000.00')
+
+        # The page is cached
+        with self.assertNumQueries(0):
+            self.client.get(reverse('SellerList'))
+
+    def test_get_sellers_ordering(self):
+        response = self.client.get(reverse('SellerList'), {'ordering': '-max_price'})
+        self.assertEqual([s['id'] for s in response.data['results']], [self.user3.pk, self.user1.pk])
+
+        response = self.client.get(reverse('SellerList'), {'ordering': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_sellers_page_parameters(self):
+        for params in ({'page': 'x'}, {'page_size': '1e3'}, {'page': 0}):
+            response = self.client.get(reverse('SellerList'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Spellings of the same page share its cache entry
+        self.client.get(reverse('SellerList'), {'page_size': 500})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('SellerList'), {'page': '01', 'page_size': 200})
+        self.assertEqual(response.data['count'], 2)
+
+
 class AuthenticationTests(APITestCase):
 
     def setUp(self):
@@ -105,3 +159,29 @@ class AuthenticationTests(APITestCase):
         for data in self.test_cases:
             response = self.client.post(reverse('Signup'), data)
             self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ThrottleTests(APITestCase):
+
+    def setUp(self):
+        reset_bucket_stores()
+
+    def test_bucket_store_shared_through_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'throttle.bin')
+            # Two stores on the same file behave like two worker processes
+            first, second = BucketStore(path, 64), BucketStore(path, 64)
+            self.assertEqual(first.consume('client', 2, 1 / 60), 0)
+            self.assertEqual(second.consume('client', 2, 1 / 60), 0)
+            self.assertGreater(first.consume('client', 2, 1 / 60), 0)
+            self.assertEqual(second.consume('other_client', 2, 1 / 60), 0)
+
+    def test_login_throttled(self):
+        rates = {'anon': '300/min', 'user': '1000/min', 'login': '2/min'}
+        with mock.patch.object(LoginThrottle, 'THROTTLE_RATES', rates):
+            data = {'username': 'throttled', 'password': 'wrongpassword'}
+            # The client controlled X-Forwarded-For header doesn't get it a new bucket
+            responses = [self.client.post(reverse('Login'), data, HTTP_X_FORWARDED_FOR=f'10.0.0.{i}') for i in range(3)]
+
+        self.assertEqual([r.status_code for r in responses[:2]], [status.HTTP_401_UNAUTHORIZED] * 2)
+        self.assertEqual(responses[2].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import UserView, login, signup
+from .views import UserView, login, signup, get_sellers
 
 urlpatterns = [
     # Authentication
@@ -10,4 +10,7 @@ urlpatterns = [
     path('', UserView.as_view(), name="UserList"),
     # Methods: GET (single user), PUT (update), DELETE (remove user)
     path('<int:pk>/', UserView.as_view(), name="UserDetailUpdateDelete"),
+
+    # Method: GET (paginated sellers with listing statistics)
+    path('sellers/', get_sellers, name="SellerList"),
 ]
@@ -1,14 +1,19 @@
 from django.contrib.auth import authenticate
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
-from .serializers import UserSerializer
+from .serializers import UserSerializer, SellerSerializer
 from django.db import transaction
+from django.db.models import Count, Min, Max, Avg
+from django.core.cache import cache
+from api.throttling import LoginThrottle, throttles_with
 from rest_framework import status
+from hashlib import md5
 
 
 """
@@ -55,6 +60,62 @@ class UserView(APIView):
 
 
 
+"""
+Seller Directory
+================
+
+This code lists the users that have vehicles listed, together with their listing statistics.
+The statistics are computed for all sellers of a page in one grouped query and the pages are cached.
+"""
+
+SELLER_ORDERING_FIELDS = ['active_listings', 'min_price', 'max_price', 'avg_price', 'newest_listing', 'username']
+SELLER_CACHE_TIMEOUT = 60
+
+
+class SellerPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_sellers(request):
+    ordering = request.query_params.get('ordering', '-active_listings')
+    if ordering.lstrip('-') not in SELLER_ORDERING_FIELDS:
+        return Response(f"Ordering must be one of: {', '.join(SELLER_ORDERING_FIELDS)}", status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        page_number = int(request.query_params.get('page', 1))
+        page_size = int(request.query_params.get('page_size', SellerPagination.page_size))
+    except ValueError:
+        return Response("The page and page_size parameters must be integers!", status=status.HTTP_400_BAD_REQUEST)
+    if page_number < 1 or page_size < 1:
+        return Response("The page and page_size parameters must be positive!", status=status.HTTP_400_BAD_REQUEST)
+
+    # The pagination caps the page size the same way
+    page_size = min(page_size, SellerPagination.max_page_size)
+    cache_key = f"sellers:{md5(f'{ordering}:{page_number}:{page_size}'.encode()).hexdigest()}"
+    data = cache.get(cache_key)
+    if data is None:
+        queryset = User.objects.annotate(
+            active_listings=Count('vehicle'),
+            min_price=Min('vehicle__price'),
+            max_price=Max('vehicle__price'),
+            avg_price=Avg('vehicle__price'),
+            newest_listing=Max('vehicle__created_at'),
+        ).filter(active_listings__gt=0).order_by(ordering, 'id')
+
+        paginator = SellerPagination()
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = SellerSerializer(page, many=True)
+        data = paginator.get_paginated_response(serializer.data).data
+        cache.set(cache_key, data, SELLER_CACHE_TIMEOUT)
+
+    return Response(data, status=status.HTTP_200_OK)
+
+
+
 """
 Authentication
 ===============
@@ -69,6 +130,7 @@ def create_token(user):
     return token.key
 
 @api_view(['POST'])
+@throttle_classes(throttles_with(LoginThrottle))
 def login(request):
     """Handle user login."""
     username = request.data.get('username')
@@ -1,6 +1,184 @@
-from django.contrib import admin
-from .models import Vehicle, VehicleImage
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django import forms
+from decimal import Decimal, InvalidOperation
+from .models import Vehicle, VehicleImage, ChangeLogEntry
+from .changes import record_changes
+from .catalog import invalidate_vehicle_details
+from .matching import notify_saved_searches
+from .live import publish_vehicle_changes
 
 
-admin.site.register(Vehicle)
-admin.site.register(VehicleImage)
+"""
+Admin
+=====
+
+The vehicle and image tables get large, so their change lists never count or scan a whole table: the
+unfiltered count is the database's row estimate, filtered counts stop at ADMIN_COUNT_LIMIT, the list
+filters use indexed columns and small lookup tables, and the foreign keys use raw id widgets instead of
+loading every user into a dropdown. Bulk actions work through the selection in batches.
+"""
+
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_BATCH_SIZE = 500
+
+
+def estimated_row_count(model):
+    """The database's estimate of the table's row count, None if it has none."""
+    table = model._meta.db_table
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == 'mysql':
+                cursor.execute("SELECT table_rows FROM information_schema.tables "
+                               "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+            elif connection.vendor == 'sqlite':
+                # Only there once ANALYZE has run, the first number is the row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if not self.object_list.query.has_filters():
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None and estimate > ADMIN_COUNT_LIMIT:
+                return estimate
+        # Counting stops at the limit, pages past it aren't listed
+        return self.object_list.order_by()[:ADMIN_COUNT_LIMIT].count()
+
+
+def batched_ids(queryset):
+    """Yield the ids of the queryset in batches, in id order."""
+    queryset = queryset.order_by('pk')
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_id).values_list('pk', flat=True)[:ADMIN_BATCH_SIZE])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered count of "x results (y total)"
+    show_full_result_count = False
+    ordering = ['-id']
+    list_per_page = 50
+
+    def get_actions(self, request):
+        # The default delete collects every selected object on one confirmation page
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class YearListFilter(admin.SimpleListFilter):
+    # Fixed choices, listing the distinct years would scan the table
+    title = 'year'
+    parameter_name = 'year'
+
+    def lookups(self, request, model_admin):
+        current = timezone.now().year
+        return [(str(year), str(year)) for year in range(current + 1, current - 30, -1)]
+
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(year=int(self.value()))
+        return queryset
+
+
+class VehicleActionForm(ActionForm):
+    percent = forms.DecimalField(required=False, max_digits=5, decimal_places=2, label="Percent:",
+                                 help_text="Used by the reprice action, e.g. -5 lowers prices by 5%")
+
+
+@admin.register(Vehicle)
+class VehicleAdmin(LargeTableAdmin):
+    list_display = ['id', 'make', 'model', 'year', 'price', 'mileage', 'fuel_type', 'owner', 'created_at']
+    list_select_related = ['owner', 'make', 'model', 'fuel_type']
+    list_filter = ['make', 'fuel_type', YearListFilter]
+    raw_id_fields = ['owner']
+    readonly_fields = ['image_count', 'cover_image', 'created_at']
+    action_form = VehicleActionForm
+    actions = ['reprice_vehicles', 'delete_vehicles']
+
+    @admin.action(description="Reprice selected vehicles by the given percent", permissions=['change'])
+    def reprice_vehicles(self, request, queryset):
+        try:
+            percent = Decimal(request.POST.get('percent', ''))
+        except InvalidOperation:
+            percent = None
+        if percent is None or not percent.is_finite() or not -100 < percent <= 100:
+            self.message_user(request, "Enter a percent between -100 and 100.", messages.ERROR)
+            return
+
+        factor = 1 + percent / 100
+        count = 0
+        for ids in batched_ids(queryset):
+            with transaction.atomic():
+                # update() doesn't send signals, the change log and caches are handled here
+                Vehicle.objects.filter(pk__in=ids).update(price=Round(F('price') * factor, 2))
+                vehicles = list(Vehicle.objects.filter(pk__in=ids))
+                record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.UPDATED, ids)
+                invalidate_vehicle_details(ids)
+                notify_saved_searches(vehicles)
+                publish_vehicle_changes('updated', vehicles)
+            count += len(ids)
+        self.message_user(request, f"Repriced {count} vehicles by {percent}%.", messages.SUCCESS)
+
+    @admin.action(description="Delete selected vehicles", permissions=['delete'])
+    def delete_vehicles(self, request, queryset):
+        count = 0
+        for ids in batched_ids(queryset):
+            count += Vehicle.objects.filter(pk__in=ids).delete()[1].get(Vehicle._meta.label, 0)
+        self.message_user(request, f"Deleted {count} vehicles.", messages.SUCCESS)
+
+
+@admin.register(VehicleImage)
+class VehicleImageAdmin(LargeTableAdmin):
+    list_display = ['id', 'vehicle', 'image', 'created_at']
+    list_select_related = ['vehicle', 'vehicle__make', 'vehicle__model']
+    raw_id_fields = ['vehicle']
+    actions = ['delete_images']
+
+    def get_readonly_fields(self, request, obj=None):
+        # The blob references are counted when an image is created, a new file is a new image
+        return ['image', 'blob'] if obj else ['blob']
+
+    def save_model(self, request, obj, form, change):
+        # Moving an image changes the image fields of both vehicles, deleting one goes through
+        # VehicleImage.delete() which updates them as well
+        old_vehicle_id = VehicleImage.objects.filter(pk=obj.pk).values_list('vehicle_id', flat=True).first() if change else None
+        with transaction.atomic():
+            # Same lock order as VehicleImageView and deletion.py, the vehicles first
+            vehicle_ids = {obj.vehicle_id, old_vehicle_id} - {None}
+            vehicles = list(Vehicle.objects.select_for_update().filter(pk__in=vehicle_ids).order_by('pk'))
+            super().save_model(request, obj, form, change)
+            for vehicle in vehicles:
+                vehicle.refresh_image_fields()
+
+    @admin.action(description="Delete selected images", permissions=['delete'])
+    def delete_images(self, request, queryset):
+        count = 0
+        for ids in batched_ids(queryset):
+            # Locks the vehicles and recomputes their image fields, see deletion.py
+            count += VehicleImage.objects.filter(pk__in=ids).delete()[1].get(VehicleImage._meta.label, 0)
+        self.message_user(request, f"Deleted {count} images.", messages.SUCCESS)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class VehicleConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "vehicle"
+
+    def ready(self):
+        # Register the signal handlers
+        from . import signals
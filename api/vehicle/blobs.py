@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+from .models import ImageBlob, VehicleImage, PendingMediaDeletion
+from .storage import CONTENT_HASH_NAME, content_hash
+from collections import Counter
+import os
+
+
+"""
+Image Blobs
+===========
+
+Every stored image file has an ImageBlob row counting the VehicleImage rows that use it. The file is
+only queued for deletion (see the purge_media command) when its last reference is gone.
+
+An upload of the same content can reuse a queued file before it's purged. purge_media claims the
+content first (claim_unused_files), which makes acquire_blob wait for the purge to commit, and
+acquire_blob writes the file again if it's gone by then.
+"""
+
+def acquire_blob(image):
+    """Count the image in the blob of its content, creating the blob for new content."""
+    name = os.path.basename(image.image.name)
+    # Content addressed names are the hash of the content, other files have to be read
+    if CONTENT_HASH_NAME.fullmatch(name):
+        digest = os.path.splitext(name)[0]
+    else:
+        digest = content_hash(image.image)
+
+    # Set by VehicleImage.save() for uploads
+    uploaded_file = getattr(image, 'uploaded_file', None)
+    with transaction.atomic():
+        blob, _ = ImageBlob.objects.select_for_update().get_or_create(
+            sha256=digest, defaults={'name': image.image.name, 'size': (uploaded_file or image.image).size}
+        )
+        ImageBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+
+        # Purged since the upload found it stored (see purge_media), the upload writes it again
+        if uploaded_file is not None and not image.image.storage.exists(blob.name):
+            image.image.storage.save(blob.name, uploaded_file)
+
+        # The same content can already be stored under another name (e.g. another extension),
+        # the image then uses the blob's file and its own copy is dropped
+        if image.image.name != blob.name:
+            PendingMediaDeletion.objects.create(path=image.image.name)
+            image.image.name = blob.name
+
+        # update() rather than save(), the image's post_save handlers must not run again
+        VehicleImage.objects.filter(id=image.id).update(blob=blob, image=blob.name)
+        image.blob = blob
+    return blob
+
+
+def release_blobs(images):
+    """
+    Drop the references of deleted images, given as (path, blob_id) pairs. Blobs left without a
+    reference are removed and their files queued, with a few queries whatever the number of images.
+    """
+    # Images stored before deduplication use their file alone
+    paths = [path for path, blob_id in images if path and blob_id is None]
+    references = Counter(blob_id for path, blob_id in images if blob_id is not None)
+
+    with transaction.atomic():
+        blobs = list(ImageBlob.objects.select_for_update().filter(id__in=references).values_list('id', 'name', 'ref_count'))
+        released = [(pk, name) for pk, name, ref_count in blobs if ref_count <= references[pk]]
+        kept = [pk for pk, name, ref_count in blobs if ref_count > references[pk]]
+
+        if kept:
+            # One grouped update, every blob loses the number of its deleted images
+            ImageBlob.objects.filter(id__in=kept).update(ref_count=Case(
+                *[When(id=pk, then=F('ref_count') - references[pk]) for pk in kept],
+                default=F('ref_count'), output_field=ImageBlob._meta.get_field('ref_count'),
+            ))
+        if released:
+            ImageBlob.objects.filter(id__in=[pk for pk, name in released]).delete()
+            paths += [name for pk, name in released]
+        PendingMediaDeletion.objects.bulk_create(PendingMediaDeletion(path=path) for path in paths)
+
+
+def claim_unused_files(paths):
+    """
+    Return the paths no image blob uses, for purge_media. Until the transaction ends, uploads of their
+    content wait in acquire_blob: a placeholder blob (without references) is inserted for each content
+    addressed path, it conflicts with the blob an upload creates. Must run inside a transaction.
+    """
+    digests = {}
+    for path in paths:
+        name = os.path.basename(path)
+        if CONTENT_HASH_NAME.fullmatch(name):
+            digests[os.path.splitext(name)[0]] = path
+
+    # Waits for uploads creating these blobs, then skips them
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(sha256=digest, name=path, size=0) for digest, path in digests.items()], ignore_conflicts=True
+    )
+    blobs = ImageBlob.objects.select_for_update().filter(sha256__in=digests)
+    live = set(blobs.filter(ref_count__gt=0).values_list('name', flat=True))
+    # The placeholders go once the files are gone, with the transaction
+    blobs.filter(ref_count=0).delete()
+    return {path for path in paths if path not in live}
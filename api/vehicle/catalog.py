@@ -0,0 +1,95 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .models import Vehicle, VehicleMake, VehicleModel
+from hashlib import md5
+
+
+"""
+Vehicle Catalog
+===============
+
+The distinct makes, and models per make, are read on every search page but rarely change, so they are
+cached. They are read from the small lookup tables, checking the (make, model) index for a listed
+vehicle. Saving or deleting a vehicle invalidates the affected lists, again once the transaction commits,
+the timeout bounds how long other worker processes can serve a stale list.
+"""
+
+CATALOG_CACHE_TIMEOUT = 60
+MAKES_CACHE_KEY = 'vehicle:makes'
+MODELS_CACHE_KEY = 'vehicle:models'
+
+
+def models_cache_key(make):
+    # Makes can contain spaces, which cache backends don't accept in keys
+    return f"vehicle:models:{md5(make.encode()).hexdigest()}"
+
+
+def delete_cached(keys):
+    """
+    Delete cache entries made stale by the running transaction, right away and again once it commits:
+    a read that started before the write can still cache the old rows after the first delete.
+    """
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def cached_vehicle_makes():
+    makes = cache.get(MAKES_CACHE_KEY)
+    if makes is None:
+        listed = VehicleMake.objects.filter(Exists(Vehicle.objects.filter(make=OuterRef('pk'))))
+        makes = [{'make': name} for name in listed.order_by('name').values_list('name', flat=True)]
+        cache.set(MAKES_CACHE_KEY, makes, CATALOG_CACHE_TIMEOUT)
+    return makes
+
+
+def cached_vehicle_models(make):
+    key = models_cache_key(make)
+    models = cache.get(key)
+    if models is None:
+        listed = VehicleModel.objects.filter(Exists(Vehicle.objects.filter(model=OuterRef('pk'), make__name=make)))
+        models = [{'model': name} for name in listed.order_by('name').values_list('name', flat=True)]
+        cache.set(key, models, CATALOG_CACHE_TIMEOUT)
+    return models
+
+
+def cached_all_vehicle_models():
+    """The distinct model names of all makes."""
+    models = cache.get(MODELS_CACHE_KEY)
+    if models is None:
+        listed = VehicleModel.objects.filter(Exists(Vehicle.objects.filter(model=OuterRef('pk'))))
+        models = list(listed.order_by('name').values_list('name', flat=True))
+        cache.set(MODELS_CACHE_KEY, models, CATALOG_CACHE_TIMEOUT)
+    return models
+
+
+def invalidate_catalog(make):
+    delete_cached([MAKES_CACHE_KEY, MODELS_CACHE_KEY, models_cache_key(make)])
+
+
+def prime_catalog_cache():
+    """Warmup hook, loads the makes and the models of every make into the cache."""
+    for make in cached_vehicle_makes():
+        cached_vehicle_models(make['make'])
+    cached_all_vehicle_models()
+
+
+"""
+Vehicle Detail Cache
+====================
+
+The detail representation of a vehicle (with owner and images) is cached per vehicle. Changes to the
+vehicle, its images or its owner delete the entry, again once the transaction commits. The entries are only
+used with a cache shared by all worker processes (the VEHICLE_DETAIL_CACHE setting), otherwise an
+owner's change would stay invisible to the other workers until the timeout.
+"""
+
+DETAIL_CACHE_TIMEOUT = 300
+
+
+def detail_cache_key(pk):
+    return f"vehicle:detail:{pk}"
+
+
+def invalidate_vehicle_details(ids):
+    delete_cached([detail_cache_key(pk) for pk in ids])
@@ -0,0 +1,86 @@
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+from datetime import timedelta
+from .models import Vehicle, ChangeLogEntry, ChangeLogHorizon
+
+
+"""
+Change Log
+==========
+
+Every create, update and delete of a vehicle or a vehicle image is recorded in ChangeLogEntry within
+the same transaction as the change, which lets clients fetch only what changed since their cursor.
+
+The cursor only works if entries become visible in id order: a client that has read past an id must
+never see a smaller one commit later. SQLite runs one write transaction at a time, so this holds there.
+On PostgreSQL, where ids are assigned at insert time by concurrent transactions, recording takes a
+transaction level advisory lock, so the transactions writing entries commit one after the other.
+Other databases aren't supported.
+"""
+
+# Key of the PostgreSQL advisory lock serializing the change log writers
+CHANGE_LOG_LOCK = 7301
+
+def record_changes(object_type, action, ids):
+    """Record the same change for many objects with a single insert."""
+    if not ids:
+        return
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CHANGE_LOG_LOCK])
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(object_type=object_type, object_id=pk, action=action) for pk in ids
+    )
+
+
+def record_unlogged_vehicles(batch_size=500):
+    """
+    Record vehicles without any entry as created, e.g. vehicles stored before the change log existed,
+    so bootstrapping with since=0 brings them in. Returns the number of recorded vehicles.
+    """
+    logged = ChangeLogEntry.objects.filter(object_type=ChangeLogEntry.VEHICLE, object_id=OuterRef('pk'))
+    unlogged = Vehicle.objects.filter(~Exists(logged)).order_by('id').values_list('id', flat=True)
+    recorded = 0
+    while True:
+        with transaction.atomic():
+            ids = list(unlogged[:batch_size])
+            record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.CREATED, ids)
+        if not ids:
+            return recorded
+        recorded += len(ids)
+
+
+def compact_change_log(retention_days):
+    """
+    Drop entries superseded by a newer entry for the same object, then entries older than the
+    retention period. The newest entry always stays so latest_cursor() never goes back.
+    Returns the number of removed entries.
+    """
+    # A cursor before a superseded entry still gets the object's newest entry, only expired entries
+    # move the horizon
+    newest = ChangeLogEntry.objects.values('object_type', 'object_id').annotate(newest_id=Max('id'))
+    superseded, _ = ChangeLogEntry.objects.exclude(id__in=newest.values('newest_id')).delete()
+
+    last_id = ChangeLogEntry.objects.aggregate(last_id=Max('id'))['last_id']
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    with transaction.atomic():
+        expired_entries = ChangeLogEntry.objects.filter(created_at__lt=cutoff).exclude(id=last_id)
+        expired_id = expired_entries.aggregate(expired_id=Max('id'))['expired_id']
+        expired, _ = expired_entries.delete()
+        if expired_id is not None:
+            horizon, _ = ChangeLogHorizon.objects.select_for_update().get_or_create(pk=1)
+            if expired_id > horizon.expired_id:
+                horizon.expired_id = expired_id
+                horizon.save(update_fields=['expired_id'])
+    return superseded + expired
+
+
+def change_log_horizon():
+    """Return the oldest cursor that can still be synced from, older cursors need a full resync."""
+    return ChangeLogHorizon.objects.filter(pk=1).values_list('expired_id', flat=True).first() or 0
+
+
+def latest_cursor():
+    """Return the cursor of the newest entry, 0 if there is none."""
+    return ChangeLogEntry.objects.aggregate(last_id=Max('id'))['last_id'] or 0
@@ -0,0 +1,116 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from .models import Vehicle, VehicleCount, ValueHistogram
+from bisect import bisect_right
+
+
+"""
+Search Result Counts
+====================
+
+Counting the vehicles matching a search exactly scans every match, which gets slow for broad searches.
+Small results are still counted exactly, larger ones are estimated from:
+- VehicleCount, the number of vehicles per make, model and year, kept up to date by the Vehicle signals
+- equi-depth histograms of price and mileage, which give the share of vehicles above or below a value
+
+The price and mileage shares are assumed to be the same for every make, model and year. The refresh_counts
+command rebuilds both (e.g. nightly), which also corrects the counts for vehicles added by bulk_create.
+"""
+
+COUNT_EXACT_LIMIT = 1000
+HISTOGRAM_BUCKETS = 100
+HISTOGRAM_FIELDS = ['price', 'mileage']
+COUNTED_FIELDS = {'make', 'model', 'year'}
+
+
+def count_key(vehicle):
+    return (vehicle.make_id, vehicle.model_id, vehicle.year)
+
+
+def adjust_counts(deltas):
+    """Apply {(make_id, model_id, year): delta} to the count table."""
+    for (make_id, model_id, year), delta in deltas.items():
+        if delta == 0:
+            continue
+        rows = VehicleCount.objects.filter(make_id=make_id, model_id=model_id, year=year)
+        if rows.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                VehicleCount.objects.create(make_id=make_id, model_id=model_id, year=year, count=delta)
+        except IntegrityError:
+            # Created concurrently
+            rows.update(count=F('count') + delta)
+
+
+def refresh_vehicle_counts():
+    counts = (Vehicle.objects.order_by().values('make_id', 'model_id', 'year').annotate(count=Count('id')))
+    with transaction.atomic():
+        VehicleCount.objects.all().delete()
+        VehicleCount.objects.bulk_create(
+            (VehicleCount(make_id=row['make_id'], model_id=row['model_id'], year=row['year'], count=row['count'])
+             for row in counts.iterator(chunk_size=2000)),
+            batch_size=2000,
+        )
+
+
+def refresh_histograms(buckets=HISTOGRAM_BUCKETS):
+    for field in HISTOGRAM_FIELDS:
+        total = Vehicle.objects.count()
+        bounds = []
+        if total:
+            # One pass over the sorted values, keeping the bucket boundaries
+            step = total / buckets
+            marks = {min(round(step * i), total - 1) for i in range(buckets + 1)}
+            values = Vehicle.objects.order_by(field).values_list(field, flat=True)
+            bounds = [float(value) for i, value in enumerate(values.iterator(chunk_size=2000)) if i in marks]
+        ValueHistogram.objects.update_or_create(field=field, defaults={'bounds': bounds, 'total': total})
+
+
+def share_below(bounds, value):
+    """Share of the vehicles with a field value below value, interpolated within its bucket."""
+    if not bounds or value <= bounds[0]:
+        return 0.0
+    if value > bounds[-1]:
+        return 1.0
+    i = bisect_right(bounds, value) - 1
+    i = min(i, len(bounds) - 2)
+    width = bounds[i + 1] - bounds[i]
+    within = (value - bounds[i]) / width if width else 1.0
+    return (i + within) / (len(bounds) - 1)
+
+
+def estimate_count(filters):
+    """
+    Estimate the number of vehicles matching the search filters, see search_filters() in views.py.
+    None if there's no histogram for a range that is filtered on.
+    """
+    counts = VehicleCount.objects.all()
+    for lookup in ['make__in', 'model__in', 'year__gte']:
+        if lookup in filters:
+            counts = counts.filter(**{lookup: filters[lookup]})
+    estimate = counts.aggregate(total=Sum('count'))['total'] or 0
+
+    ranges = {'price__gte': ('price', False), 'mileage__lte': ('mileage', True)}
+    used = {field: (filters[lookup], below) for lookup, (field, below) in ranges.items() if lookup in filters}
+    if used:
+        histograms = dict(ValueHistogram.objects.filter(field__in=used).values_list('field', 'bounds'))
+        for field, (value, below) in used.items():
+            if not histograms.get(field):
+                return None
+            share = share_below(histograms[field], float(value))
+            estimate *= share if below else 1 - share
+    return round(estimate)
+
+
+def count_vehicles(filters):
+    """Return (count, exact). Results up to COUNT_EXACT_LIMIT are counted, larger ones estimated."""
+    estimate = estimate_count(filters)
+    if estimate is not None and estimate > COUNT_EXACT_LIMIT:
+        return estimate, False
+
+    # The estimate can be off, the exact count stops past the limit
+    counted = Vehicle.objects.filter(**filters).order_by()[:COUNT_EXACT_LIMIT + 1].count()
+    if counted <= COUNT_EXACT_LIMIT:
+        return counted, True
+    return max(estimate or 0, counted), False
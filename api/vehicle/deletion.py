@@ -0,0 +1,64 @@
+from django.db import transaction
+from .models import Vehicle, VehicleImage, VehicleMake, ChangeLogEntry
+from .dimensions import dimension_cache
+from .blobs import release_blobs
+from .changes import record_changes
+from .catalog import invalidate_catalog, invalidate_vehicle_details
+from .counting import adjust_counts, count_key
+from .live import publish_vehicle_changes
+from collections import Counter
+from contextlib import contextmanager
+
+
+"""
+Deletes
+=======
+
+Vehicles and images have no delete signal handlers: with one, Django deletes every cascaded image
+on its own and runs the handlers per row. Instead Vehicle and VehicleImage (their delete() and their
+querysets' delete()) read what is about to be deleted, and once the rows are gone update the change
+log, the blob references, the media queue, the counts, the caches and the live feed with a few grouped
+queries for the whole selection. A user's vehicles are deleted the same way before the user.
+"""
+
+def read_images(images):
+    return list(images.order_by().values_list('id', 'vehicle_id', 'image', 'blob_id'))
+
+
+def release_images(images):
+    record_changes(ChangeLogEntry.IMAGE, ChangeLogEntry.DELETED, [pk for pk, vehicle_id, path, blob_id in images])
+    release_blobs([(path, blob_id) for pk, vehicle_id, path, blob_id in images])
+
+
+@contextmanager
+def deleting_vehicles(queryset):
+    """Wraps the delete of the queryset's vehicles, their images are deleted by the cascade."""
+    with transaction.atomic():
+        vehicles = list(queryset.order_by().only('id', 'make', 'model', 'year', 'price'))
+        ids = [vehicle.pk for vehicle in vehicles]
+        images = read_images(VehicleImage.objects.filter(vehicle_id__in=ids))
+        yield
+
+        record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.DELETED, ids)
+        release_images(images)
+        adjust_counts({key: -count for key, count in Counter(count_key(vehicle) for vehicle in vehicles).items()})
+        for make_id in {vehicle.make_id for vehicle in vehicles}:
+            invalidate_catalog(dimension_cache(VehicleMake).get(make_id).name)
+        invalidate_vehicle_details(ids)
+        publish_vehicle_changes('deleted', vehicles)
+
+
+@contextmanager
+def deleting_images(queryset):
+    """Wraps the delete of the queryset's images, then recomputes the image fields of their vehicles."""
+    with transaction.atomic():
+        images = read_images(queryset)
+        vehicle_ids = {vehicle_id for pk, vehicle_id, path, blob_id in images}
+        # Same lock order as VehicleImageView, the vehicles first
+        vehicles = list(Vehicle.objects.select_for_update().filter(pk__in=vehicle_ids).order_by('pk'))
+        yield
+
+        release_images(images)
+        # Saving the vehicles records their change and invalidates their details
+        for vehicle in vehicles:
+            vehicle.refresh_image_fields()
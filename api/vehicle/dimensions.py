@@ -0,0 +1,121 @@
+from django.db import models, transaction
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+
+
+"""
+Dimension Tables
+================
+
+Make, model, color, fuel type and transmission are stored once in small lookup tables and referenced
+from the vehicles by integer keys. The rows never change once created, so every process keeps them in
+memory and serializing a vehicle doesn't join or query the lookup tables.
+
+Rows read or created inside a transaction could still be rolled back, they are only added to the
+process cache once committed (right away in autocommit mode).
+
+A vehicle's dimensions can be assigned by name, e.g. Vehicle(make='AUDI'). A name missing from the
+process cache is kept on an unsaved row and only looked up or created when the vehicle is saved.
+Lookups don't resolve names, they go through the name column: filter(make__name='AUDI').
+"""
+
+
+class DimensionCache:
+    def __init__(self, model):
+        self.model = model
+        self.rows = {}
+        self.ids = {}
+
+    def remember(self, rows):
+        def update():
+            for row in rows:
+                self.rows[row.pk] = row
+                self.ids[row.name] = row.pk
+        transaction.on_commit(update)
+
+    def get(self, pk):
+        row = self.rows.get(pk)
+        if row is None:
+            row = self.model.objects.get(pk=pk)
+            self.remember([row])
+        return row
+
+    def cached(self, name):
+        pk = self.ids.get(name)
+        return None if pk is None else self.rows[pk]
+
+    def get_or_create(self, name):
+        row = self.cached(name)
+        if row is not None:
+            return row
+        row, _ = self.model.objects.get_or_create(name=name)
+        self.remember([row])
+        return row
+
+    def find(self, names):
+        """Return the ids of the rows with these names, unknown names are skipped."""
+        ids = [self.ids[name] for name in names if name in self.ids]
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            rows = list(self.model.objects.filter(name__in=missing))
+            self.remember(rows)
+            ids += [row.pk for row in rows]
+        return ids
+
+    def load(self):
+        """Return every row by id."""
+        rows = {row.pk: row for row in self.model.objects.all()}
+        self.remember(list(rows.values()))
+        return rows
+
+
+_caches = {}
+
+
+def dimension_cache(model):
+    if model not in _caches:
+        _caches[model] = DimensionCache(model)
+    return _caches[model]
+
+
+def clear_dimension_caches():
+    _caches.clear()
+
+
+class DimensionDescriptor(ForwardManyToOneDescriptor):
+    """Reads the row from the process cache, and accepts a name, e.g. vehicle.make = 'AUDI'."""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        if self.field.is_cached(instance):
+            return self.field.get_cached_value(instance)
+        pk = getattr(instance, self.field.attname)
+        return None if pk is None else dimension_cache(self.field.related_model).get(pk)
+
+    def __set__(self, instance, value):
+        if isinstance(value, str):
+            # Unsaved until the instance is saved, see DimensionNamesMixin
+            value = dimension_cache(self.field.related_model).cached(value) or self.field.related_model(name=value)
+        super().__set__(instance, value)
+
+
+class DimensionForeignKey(models.ForeignKey):
+    """Lookups take ids or rows, not names, e.g. filter(make__name='AUDI') rather than filter(make='AUDI')."""
+    forward_related_accessor_class = DimensionDescriptor
+
+    def __init__(self, to, **kwargs):
+        kwargs.setdefault('on_delete', models.PROTECT)
+        super().__init__(to, **kwargs)
+
+
+class DimensionNamesMixin:
+    """For models with DimensionForeignKeys, looks up or creates the rows assigned by name before saving."""
+
+    def _prepare_related_fields_for_save(self, operation_name, fields=None):
+        # Also called by bulk_create and bulk_update, before Django rejects the unsaved rows
+        for field in self._meta.concrete_fields:
+            if isinstance(field, DimensionForeignKey) and field.is_cached(self):
+                row = field.get_cached_value(self)
+                if row is not None and row.pk is None:
+                    setattr(self, field.name, dimension_cache(field.related_model).get_or_create(row.name))
+        super()._prepare_related_fields_for_save(operation_name, fields)
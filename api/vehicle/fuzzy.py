@@ -0,0 +1,143 @@
+from .catalog import cached_vehicle_makes, cached_vehicle_models, cached_all_vehicle_models
+from functools import lru_cache
+
+
+"""
+Fuzzy Make And Model Matching
+=============================
+
+Maps what users type ("mercedes", "vw golf", "toyta") onto the makes and models that are actually
+listed, so the search can keep filtering with exact, indexed comparisons. Common short names go
+through an alias table, typos are corrected with a BK-tree over the listed names, which only
+visits the part of the vocabulary within the allowed edit distance. The listed names come from the
+catalog cache, which other processes may not have refreshed yet, so input that doesn't resolve is
+searched as typed.
+"""
+
+MAKE_ALIASES = {
+    'VW': 'VOLKSWAGEN',
+    'MERCEDES': 'MERCEDES-BENZ',
+    'MERCEDES BENZ': 'MERCEDES-BENZ',
+    'BENZ': 'MERCEDES-BENZ',
+    'MB': 'MERCEDES-BENZ',
+    'CHEVY': 'CHEVROLET',
+    'ALFA': 'ALFA ROMEO',
+    'BEEMER': 'BMW',
+}
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        # A node is (word, {distance: child})
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (word, {})
+                return
+            node = node[1][distance]
+
+    def search(self, word, max_distance):
+        """Return the (distance, word) pairs within max_distance of word."""
+        matches = []
+        candidates = [self.root] if self.root else []
+        while candidates:
+            node_word, children = candidates.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                matches.append((distance, node_word))
+            # By the triangle inequality only these subtrees can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+        return matches
+
+
+@lru_cache(maxsize=256)
+def bk_tree(words):
+    return BKTree(words)
+
+
+def allowed_typos(text):
+    # Short names get no tolerance, "BMW" must not match "VW"
+    return 0 if len(text) <= 3 else 1 if len(text) <= 6 else 2
+
+
+def closest(text, words):
+    """Return the listed words equal to text or, failing that, the closest ones within the allowed typos."""
+    if text in words:
+        return [text]
+    matches = bk_tree(tuple(words)).search(text, allowed_typos(text))
+    if not matches:
+        return []
+    best = min(distance for distance, _ in matches)
+    return sorted(word for distance, word in matches if distance == best)
+
+
+def normalize(text):
+    return ' '.join(text.upper().split())
+
+
+def resolve_makes(text):
+    text = normalize(text)
+    text = MAKE_ALIASES.get(text, text)
+    return closest(text, [make['make'] for make in cached_vehicle_makes()])
+
+
+def resolve_models(makes, text):
+    text = normalize(text)
+    if makes is None:
+        models = cached_all_vehicle_models()
+    else:
+        models = sorted({model['model'] for make in makes for model in cached_vehicle_models(make)})
+
+    if text in models:
+        return [text]
+    # A model family, "GOLF" stands for "GOLF 7" and "GOLF 8"
+    family = [model for model in models if model.startswith(text + ' ')]
+    return family or closest(text, models)
+
+
+def resolve_make_and_model(make, model):
+    """
+    Return the listed (makes, models) matching the user input, None where no input was given.
+    A make that doesn't resolve on its own is also tried as "make model", e.g. "vw golf".
+    """
+    makes = resolve_makes(make) if make else None
+
+    if make and not makes and not model:
+        words = normalize(make).split(' ')
+        for split in range(len(words) - 1, 0, -1):
+            makes = resolve_makes(' '.join(words[:split]))
+            if makes:
+                return makes, resolve_models(makes, ' '.join(words[split:]))
+
+    # Not in the (possibly stale) catalog, e.g. the first vehicle of a make listed by another process
+    if make and not makes:
+        makes = [MAKE_ALIASES.get(normalize(make), normalize(make))]
+
+    models = resolve_models(makes, model) if model else None
+    if model and not models:
+        models = [normalize(model)]
+    return makes, models
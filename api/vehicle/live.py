@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .serializers import VehicleListSerializer
+from decimal import Decimal
+import asyncio
+import json
+import threading
+
+
+"""
+Live Listings Feed
+==================
+
+Pushes new, updated and deleted vehicles to Server-Sent Events subscribers, so clients don't have to
+poll the vehicle list. Subscribers are coroutines on the ASGI event loop, an idle one only costs a
+small queue, so a worker holds thousands of them.
+
+Changes are published by the Vehicle signals once their transaction commits, and fanned out by the
+hub of the process. Every subscriber has a bounded buffer, one that falls LIVE_BUFFER_SIZE events
+behind is dropped (the browser reconnects) instead of holding the events in memory.
+
+The hub only sees the changes made by its own process, deployments with several worker processes
+have to route the writes and the feed to the same ones, or accept a partial feed per worker.
+"""
+
+DROPPED = object()
+RECONNECT_MILLISECONDS = 3000
+
+
+class Subscriber:
+    def __init__(self, loop, buffer_size, make=None, model=None, min_price=None, max_price=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(buffer_size)
+        self.make = make.upper() if make else None
+        self.model = model.upper() if model else None
+        self.min_price = min_price
+        self.max_price = max_price
+        self.dropped = False
+
+    def matches(self, vehicle):
+        price = Decimal(vehicle['price'])
+        return ((self.make is None or vehicle['make'] == self.make)
+                and (self.model is None or vehicle['model'] == self.model)
+                and (self.min_price is None or price >= self.min_price)
+                and (self.max_price is None or price <= self.max_price))
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow, the buffered events are replaced by the notice that closes the stream
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(DROPPED)
+            self.dropped = True
+
+
+class LiveHub:
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, **filters):
+        """Register a subscriber, must be called on its event loop."""
+        subscriber = Subscriber(asyncio.get_running_loop(), self.buffer_size, **filters)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event_type, vehicles):
+        """Queue the event of every vehicle for the matching subscribers, from any thread."""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        loops = {}
+        for subscriber in subscribers:
+            loops.setdefault(subscriber.loop, []).append(subscriber)
+
+        # One callback per event loop, the queues are only touched from their own loop
+        for loop, group in loops.items():
+            loop.call_soon_threadsafe(self.fan_out, group, event_type, vehicles)
+
+    def fan_out(self, subscribers, event_type, vehicles):
+        for subscriber in subscribers:
+            for vehicle in vehicles:
+                if subscriber.dropped:
+                    break
+                if subscriber.matches(vehicle):
+                    subscriber.deliver({'type': event_type, 'vehicle': vehicle})
+
+
+hub = LiveHub(settings.LIVE_BUFFER_SIZE)
+
+
+def publish_vehicle_changes(event_type, vehicles):
+    """Publish saved vehicles once the transaction commits, nothing is done without subscribers."""
+    if not hub.subscribers:
+        return
+
+    if event_type == 'deleted':
+        # Deleted vehicles lose their id after the signals, the event is built right away
+        data = [{'id': vehicle.pk, 'make': vehicle.make.name, 'model': vehicle.model.name, 'price': str(vehicle.price)}
+                for vehicle in vehicles]
+        transaction.on_commit(lambda: hub.publish(event_type, data))
+    else:
+        transaction.on_commit(lambda: hub.publish(event_type, VehicleListSerializer(vehicles, many=True).data))
+
+
+def format_event(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def event_stream(**filters):
+    subscriber = hub.subscribe(**filters)
+    try:
+        yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), settings.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                yield ": heartbeat\n\n"
+                continue
+            if event is DROPPED:
+                yield format_event('dropped', {})
+                break
+            yield format_event(event['type'], event['vehicle'])
+    finally:
+        hub.unsubscribe(subscriber)
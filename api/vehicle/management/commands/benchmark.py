@@ -0,0 +1,168 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from vehicle.models import Vehicle, VehicleMake, VehicleModel, Color, FuelType, Transmission
+from vehicle.dimensions import dimension_cache
+from vehicle.serializers import MAX_BULK_ITEMS
+from vehicle.views import VehicleView, VehicleBulkView, get_vehicle_by_query, search_filters
+from vehicle.counting import estimate_count, refresh_histograms, refresh_vehicle_counts
+from vehicle.catalog import MAKES_CACHE_KEY, cached_vehicle_makes
+from time import perf_counter
+
+
+class Rollback(Exception):
+    """Raised at the end of a suite to throw away the benchmark data."""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API code paths against throwaway data (everything is rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['bulk', 'search', 'count'], help='Which benchmark to run')
+        parser.add_argument('--count', type=int, default=200, help='Number of vehicles to work on')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("--count must be at least 1.")
+
+        try:
+            with transaction.atomic():
+                getattr(self, f"run_{options['suite']}")(options['count'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def report(self, label, count, elapsed, queries):
+        self.stdout.write(
+            f"{label:<12} {count} items in {elapsed * 1000:.1f} ms "
+            f"({count / elapsed:.0f} items/s, {queries} queries)"
+        )
+
+    def create_vehicles(self, owner, count, makes=1):
+        # The dimension rows are looked up once, names would be resolved per vehicle inside the transaction
+        make_rows = [dimension_cache(VehicleMake).get_or_create(f'BENCHMARK {i}') for i in range(makes)]
+        model_rows = [dimension_cache(VehicleModel).get_or_create(f'CAR {i}') for i in range(makes * 5)]
+        color = dimension_cache(Color).get_or_create('BLACK')
+        fuel_type = dimension_cache(FuelType).get_or_create('PETROL')
+        transmission = dimension_cache(Transmission).get_or_create('MANUAL')
+        return Vehicle.objects.bulk_create(
+            Vehicle(owner=owner, make=make_rows[i % makes], model=model_rows[i % (makes * 5)], year=2000 + i % 25,
+                    price=10000 + i % 25 * 1000 + i % 997, mileage=i * 7919 % 200000, color=color, fuel_type=fuel_type, transmission=transmission)
+            for i in range(count)
+        )
+
+    def table_size(self):
+        """Bytes used by the vehicle and dimension tables with their indexes, None where the database can't tell."""
+        tables = [Vehicle._meta.db_table] + [
+            field.related_model._meta.db_table for field in Vehicle._meta.concrete_fields
+            if field.is_relation and field.name != 'owner'
+        ]
+        placeholders = ', '.join(['%s'] * len(tables))
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if connection.vendor == 'sqlite':
+                    cursor.execute(
+                        "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                        f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders}))", tables
+                    )
+                elif connection.vendor == 'postgresql':
+                    cursor.execute(f"SELECT SUM(pg_total_relation_size(t)) FROM unnest(ARRAY[{placeholders}]) t", tables)
+                else:
+                    return None
+                return cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+
+    def run_bulk(self, count):
+        """Reprice `count` vehicles through VehicleView.put one by one, then through VehicleBulkView in batches."""
+        owner = User.objects.create_user(username='benchmark_seller', password='benchmark')
+        vehicles = self.create_vehicles(owner, count)
+        factory = APIRequestFactory()
+
+        single_view = VehicleView.as_view(throttle_classes=[])
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            for vehicle in vehicles:
+                request = factory.put(f'/vehicle/{vehicle.id}/', {'price': 9000}, format='json')
+                force_authenticate(request, user=owner)
+                single_view(request, pk=vehicle.id)
+            elapsed = perf_counter() - start
+        self.report('single', count, elapsed, len(queries))
+
+        bulk_view = VehicleBulkView.as_view(throttle_classes=[])
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            for i in range(0, count, MAX_BULK_ITEMS):
+                payload = {'vehicles': [{'id': vehicle.id, 'price': 8000} for vehicle in vehicles[i:i + MAX_BULK_ITEMS]]}
+                request = factory.put('/vehicle/bulk/', payload, format='json')
+                force_authenticate(request, user=owner)
+                bulk_view(request)
+            elapsed = perf_counter() - start
+        self.report('bulk', count, elapsed, len(queries))
+
+    def run_search(self, count):
+        """Storage of `count` vehicles (20 makes, 100 models), then the latency of searches and catalog queries."""
+        owner = User.objects.create_user(username='benchmark_seller', password='benchmark')
+        size = self.table_size()
+        self.create_vehicles(owner, count, makes=20)
+        if size is not None:
+            grown = self.table_size() - size
+            self.stdout.write(f"{'storage':<12} {count} items in {grown / 1024:.0f} kB ({grown / count:.1f} bytes/item)")
+
+        factory = APIRequestFactory()
+        search_view = get_vehicle_by_query.cls.as_view(throttle_classes=[])
+        requests = 20
+        for label, params in [('search', {'make': 'benchmark 7'}), ('search+model', {'make': 'benchmark 7', 'model': 'car 27'})]:
+            with CaptureQueriesContext(connection) as queries:
+                start = perf_counter()
+                for _ in range(requests):
+                    search_view(factory.get('/vehicle/search/', params))
+                elapsed = perf_counter() - start
+            self.report(label, requests, elapsed, len(queries))
+
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            for _ in range(requests):
+                cache.delete(MAKES_CACHE_KEY)
+                cached_vehicle_makes()
+            elapsed = perf_counter() - start
+        self.report('makes', requests, elapsed, len(queries))
+
+    def run_count(self, count):
+        """Latency and error of the estimated search counts against exact counts, over `count` vehicles."""
+        owner = User.objects.create_user(username='benchmark_seller', password='benchmark')
+        self.create_vehicles(owner, count, makes=20)
+
+        # bulk_create skips the signals that maintain the counts
+        start = perf_counter()
+        refresh_vehicle_counts()
+        refresh_histograms()
+        self.stdout.write(f"{'refresh':<12} {count} items in {(perf_counter() - start) * 1000:.1f} ms")
+
+        requests = 20
+        searches = [
+            ('all', {}),
+            ('make', {'make': 'benchmark 7'}),
+            ('year', {'year': 2010}),
+            ('price', {'price': 25000}),
+            ('mileage', {'mileage': 50000}),
+            ('combined', {'make': 'benchmark 7', 'year': 2005, 'price': 20000, 'mileage': 150000}),
+        ]
+        for label, params in searches:
+            filters = search_filters(params)
+            timings = {}
+            for name, counter in [('exact', lambda: Vehicle.objects.filter(**filters).count()),
+                                  ('estimate', lambda: estimate_count(filters))]:
+                start = perf_counter()
+                for _ in range(requests):
+                    result = counter()
+                timings[name] = ((perf_counter() - start) / requests * 1000, result)
+            (exact_ms, exact), (estimate_ms, estimate) = timings['exact'], timings['estimate']
+            error = abs(estimate - exact) / exact * 100 if exact else 0
+            self.stdout.write(
+                f"{label:<12} exact {exact} in {exact_ms:.2f} ms, "
+                f"estimate {estimate} in {estimate_ms:.2f} ms ({error:.1f}% off)"
+            )
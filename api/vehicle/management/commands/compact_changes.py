@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from vehicle.changes import compact_change_log
+
+
+class Command(BaseCommand):
+    help = 'Compact the vehicle change log and drop entries past the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGE_LOG_RETENTION_DAYS,
+                            help='Number of days change log entries are kept')
+
+    def handle(self, *args, **options):
+        removed = compact_change_log(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} change log entries."))
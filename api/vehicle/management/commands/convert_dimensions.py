@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from vehicle.models import Vehicle, VehicleImage, ChangeLogEntry, VehicleCount
+from vehicle.changes import record_unlogged_vehicles
+from vehicle.counting import refresh_histograms, refresh_vehicle_counts
+from vehicle.schema import add_missing_fields, add_nullable_field, missing_fields
+
+# Vehicle fields that were stored as names before the dimension tables
+DIMENSION_FIELDS = ['make', 'model', 'color', 'fuel_type', 'transmission']
+
+
+class Command(BaseCommand):
+    help = 'Move the make, model, color, fuel type and transmission names of existing vehicles to the dimension tables'
+
+    def handle(self, *args, **options):
+        table = Vehicle._meta.db_table
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+            if table not in tables:
+                raise CommandError("There is no vehicle table, run migrate --run-syncdb instead.")
+            if ChangeLogEntry._meta.db_table not in tables:
+                raise CommandError("There is no change log table, run migrate --run-syncdb first.")
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+        added_to_images = add_missing_fields(VehicleImage, [field.name for field in missing_fields(VehicleImage)])
+        for name in added_to_images:
+            self.stdout.write(f"Added image {name}")
+
+        # Vehicles stored before the change log would be missing from a sync with since=0
+        recorded = record_unlogged_vehicles()
+        if recorded:
+            self.stdout.write(f"Recorded {recorded} vehicles in the change log")
+
+        legacy = [name for name in DIMENSION_FIELDS if name in columns]
+        if not legacy:
+            self.stdout.write("The vehicles already reference the dimension tables.")
+            self.fill_counts()
+            return
+
+        quote = connection.ops.quote_name
+        fields = {name: Vehicle._meta.get_field(name) for name in legacy}
+        # Columns added since the names were stored. SQLite rebuilds the table below, copying every column
+        # of the model, so they are added first (see schema.py)
+        added = [field for field in missing_fields(Vehicle) if field.name not in DIMENSION_FIELDS]
+        nullable = {}
+
+        # Add the key columns next to the names (nullable for now), and fill the lookup tables
+        with connection.schema_editor() as editor:
+            for field in added:
+                nullable[field.name] = add_nullable_field(editor, Vehicle, field)
+                self.stdout.write(f"Added {field.name}")
+
+            for name, field in fields.items():
+                dimension = field.related_model._meta.db_table
+                if dimension not in tables:
+                    editor.create_model(field.related_model)
+
+                nullable[name] = add_nullable_field(editor, Vehicle, field)
+
+                editor.execute(
+                    f"INSERT INTO {quote(dimension)} (name) SELECT DISTINCT {quote(name)} FROM {quote(table)} "
+                    f"WHERE {quote(name)} NOT IN (SELECT name FROM {quote(dimension)})"
+                )
+                editor.execute(
+                    f"UPDATE {quote(table)} SET {quote(field.column)} = (SELECT id FROM {quote(dimension)} "
+                    f"WHERE {quote(dimension)}.name = {quote(table)}.{quote(name)})"
+                )
+                self.stdout.write(f"Converted {name}")
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+
+        # Drop the names, their indexes first, then make the keys required
+        with connection.schema_editor() as editor:
+            for index_name, constraint in constraints.items():
+                if constraint['index'] and not constraint['primary_key'] and set(constraint['columns']) & set(legacy):
+                    editor.remove_index(Vehicle, models.Index(fields=constraint['columns'], name=index_name))
+            for name in legacy:
+                editor.execute(f"ALTER TABLE {quote(table)} DROP COLUMN {quote(name)}")
+            for name, added_as in nullable.items():
+                editor.alter_field(Vehicle, added_as, Vehicle._meta.get_field(name))
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        with connection.schema_editor() as editor:
+            for index in Vehicle._meta.indexes:
+                if index.name not in constraints:
+                    editor.add_index(Vehicle, index)
+
+        self.fill_counts()
+        self.stdout.write(self.style.SUCCESS(f"Converted {len(legacy)} vehicle columns to dimension tables."))
+        if added or added_to_images:
+            self.stdout.write("Run refresh_image_fields and dedupe_media to fill the added columns.")
+
+    def fill_counts(self):
+        # The count table created by migrate starts empty, the search counts would be estimated as 0
+        if not VehicleCount.objects.exists():
+            refresh_vehicle_counts()
+            refresh_histograms()
+            self.stdout.write("Filled the vehicle counts and histograms")
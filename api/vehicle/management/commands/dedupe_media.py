@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from vehicle.models import Vehicle, VehicleImage, PendingMediaDeletion, ChangeLogEntry
+from vehicle.blobs import acquire_blob
+from vehicle.changes import record_changes
+from vehicle.catalog import invalidate_vehicle_details
+from vehicle.storage import CONTENT_HASH_NAME, content_hash
+from vehicle.schema import add_missing_fields
+import os
+
+
+class Command(BaseCommand):
+    help = 'Move vehicle images stored before deduplication to shared, content addressed blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of images handled per batch')
+
+    def handle(self, *args, **options):
+        # Databases created before the blobs lack the column
+        for name in add_missing_fields(VehicleImage, ['blob']):
+            self.stdout.write(f"Added {name}")
+
+        storage = VehicleImage._meta.get_field('image').storage
+        batch_size = max(options['batch_size'], 1)
+        moved = counted = 0
+        last_id = 0
+
+        while True:
+            batch = list(VehicleImage.objects.filter(id__gt=last_id, blob__isnull=True).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for image in batch:
+                legacy_name = image.image.name
+                if not storage.exists(legacy_name):
+                    self.stderr.write(f"Image {image.id}: {legacy_name} is missing, skipped")
+                    continue
+
+                with transaction.atomic():
+                    if not CONTENT_HASH_NAME.fullmatch(os.path.basename(legacy_name)):
+                        # Copy the file to its content addressed name, this is a no-op if the content exists
+                        extension = os.path.splitext(legacy_name)[1].lower()
+                        with image.image.open('rb'):
+                            name = storage.save(f"vehicle_images/{content_hash(image.image)}{extension}", image.image)
+                        image.image.name = name
+                        PendingMediaDeletion.objects.create(path=legacy_name)
+                        moved += 1
+
+                    acquire_blob(image)
+
+                    # Cover images point at the same files
+                    covers = list(Vehicle.objects.filter(cover_image=legacy_name).values_list('id', flat=True))
+                    if covers and legacy_name != image.image.name:
+                        Vehicle.objects.filter(id__in=covers).update(cover_image=image.image.name)
+                        record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.UPDATED, covers)
+                    invalidate_vehicle_details([image.vehicle_id])
+                counted += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {counted} images in their blobs, {moved} files moved to content addressed names. "
+            "Run purge_media to remove the old copies."
+        ))
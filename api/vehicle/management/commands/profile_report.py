@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from collections import Counter
+import os
+import pstats
+
+
+def function_label(function):
+    filename, line, name = function
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class Command(BaseCommand):
+    help = 'Aggregate the request profiles captured by ProfilingMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR, help='Directory holding the captures')
+        parser.add_argument('--url-name', help='Only aggregate the captures of this URL name')
+        parser.add_argument('--top', type=int, default=20, help='Number of hot functions to list')
+        parser.add_argument('--collapsed', help='Write flamegraph compatible collapsed stacks to this file')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['dir']):
+            raise CommandError(f"{options['dir']} doesn't exist, no requests have been profiled yet.")
+
+        prefix = f"{options['url_name']}-" if options['url_name'] else ''
+        files = [entry.path for entry in os.scandir(options['dir']) if entry.name.startswith(prefix)]
+        profiles = [path for path in files if path.endswith('.prof')]
+        samples = [path for path in files if path.endswith('.collapsed')]
+        if not profiles and not samples:
+            raise CommandError("No captures found.")
+
+        # Hot functions by self time (cProfile, in ms) and by self samples (stack sampling)
+        hot_time = Counter()
+        hot_samples = Counter()
+        stacks = Counter()
+
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            for function, (_, _, total_time, _, callers) in stats.stats.items():
+                hot_time[function_label(function)] += total_time * 1000
+                # cProfile only knows direct callers, so its stacks are caller;callee pairs (in µs)
+                for caller, caller_stats in callers.items():
+                    stacks[f"{function_label(caller)};{function_label(function)}"] += round(caller_stats[2] * 1e6)
+
+        for path in samples:
+            with open(path) as capture:
+                for line in capture:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    stacks[stack] += int(count)
+                    hot_samples[stack.rsplit(';', 1)[-1]] += int(count)
+
+        for hot, captures, unit in [(hot_time, profiles, 'ms'), (hot_samples, samples, 'samples')]:
+            if captures:
+                self.stdout.write(f"Top {options['top']} functions of {len(captures)} captures ({unit}):")
+                for label, value in hot.most_common(options['top']):
+                    self.stdout.write(f"{value:>12.1f}  {label}")
+
+        if options['collapsed']:
+            with open(options['collapsed'], 'w') as output:
+                for stack, count in stacks.items():
+                    if count > 0:
+                        output.write(f"{stack} {count}\n")
+            self.stdout.write(self.style.SUCCESS(f"Collapsed stacks written to {options['collapsed']}"))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from django.db import transaction
+from vehicle.models import VehicleImage, PendingMediaDeletion
+from vehicle.blobs import claim_unused_files
+
+
+class Command(BaseCommand):
+    help = 'Remove the media files queued for deletion, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of queued files handled per batch')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        removed = 0
+        last_id = 0
+
+        while True:
+            batch = list(PendingMediaDeletion.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            paths = {entry.path for entry in batch}
+            # The files are removed inside the transaction, uploads of the same content wait for it
+            with transaction.atomic():
+                unused = claim_unused_files(paths)
+                # A file may have been referenced again since it was queued, it has to stay
+                unused -= set(VehicleImage.objects.filter(image__in=unused).values_list('image', flat=True))
+
+                failed = set()
+                for path in unused:
+                    try:
+                        default_storage.delete(path)
+                        removed += 1
+                    except OSError as e:
+                        failed.add(path)
+                        self.stderr.write(f"Could not remove {path}: {e}")
+
+                # Failed entries stay queued so the next run retries them
+                PendingMediaDeletion.objects.filter(id__in=[entry.id for entry in batch if entry.path not in failed]).delete()
+
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} media files."))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from vehicle.models import VehicleImage, PendingMediaDeletion
+from itertools import islice
+import os
+import time
+
+
+def scan_files(directory):
+    """Yield the files below directory one by one, without listing whole directories in memory."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+class Command(BaseCommand):
+    help = 'Find vehicle image files in MEDIA_ROOT that no VehicleImage row references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of files checked per query')
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help='Ignore files younger than this, their upload may still be in progress')
+        parser.add_argument('--enqueue', action='store_true', help='Queue the orphaned files for purge_media')
+
+    def handle(self, *args, **options):
+        directory = os.path.join(settings.MEDIA_ROOT, 'vehicle_images')
+        if not os.path.isdir(directory):
+            self.stdout.write("No vehicle images directory found.")
+            return
+
+        batch_size = max(options['batch_size'], 1)
+        cutoff = time.time() - options['grace_minutes'] * 60
+        files = (
+            os.path.relpath(entry.path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            for entry in scan_files(directory)
+            if entry.stat().st_mtime < cutoff
+        )
+
+        # Both sides are streamed: a batch of file names is checked against the table with one query
+        orphans = 0
+        while batch := set(islice(files, batch_size)):
+            referenced = set(VehicleImage.objects.filter(image__in=batch).values_list('image', flat=True))
+            orphaned = sorted(batch - referenced)
+            for path in orphaned:
+                self.stdout.write(path)
+            if options['enqueue']:
+                PendingMediaDeletion.objects.bulk_create(PendingMediaDeletion(path=path) for path in orphaned)
+            orphans += len(orphaned)
+
+        action = "queued for deletion" if options['enqueue'] else "found"
+        self.stdout.write(self.style.SUCCESS(f"{orphans} orphaned media files {action}."))
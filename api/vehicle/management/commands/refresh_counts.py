@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from vehicle.counting import HISTOGRAM_BUCKETS, refresh_histograms, refresh_vehicle_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the vehicle count table and the price and mileage histograms used to estimate search counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buckets', type=int, default=HISTOGRAM_BUCKETS, help='Number of histogram buckets')
+
+    def handle(self, *args, **options):
+        refresh_vehicle_counts()
+        refresh_histograms(options['buckets'])
+        self.stdout.write(self.style.SUCCESS("Refreshed the vehicle counts and histograms."))
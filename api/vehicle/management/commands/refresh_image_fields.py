@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from vehicle.models import Vehicle, VehicleImage, ChangeLogEntry
+from vehicle.changes import record_changes
+from vehicle.catalog import invalidate_vehicle_details
+from vehicle.schema import add_missing_fields
+
+
+class Command(BaseCommand):
+    help = 'Recompute the image count and cover image of every vehicle, adding the columns to older databases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of vehicles handled per batch')
+
+    def handle(self, *args, **options):
+        for name in add_missing_fields(Vehicle, ['image_count', 'cover_image']):
+            self.stdout.write(f"Added {name}")
+
+        images = VehicleImage.objects.filter(vehicle=OuterRef('pk')).order_by()
+        count = images.values('vehicle').annotate(count=Count('id')).values('count')
+        cover = images.order_by('created_at', 'id').values('image')[:1]
+        actual_count = Coalesce(Subquery(count), 0)
+        actual_cover = Coalesce(Subquery(cover), Value(''))
+        actual = Vehicle.objects.annotate(actual_count=actual_count, actual_cover=actual_cover)
+
+        batch_size = max(options['batch_size'], 1)
+        refreshed = 0
+        last_id = 0
+        while True:
+            batch = list(Vehicle.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            with transaction.atomic():
+                # Only the vehicles that are off are updated and logged
+                stale = list(
+                    actual.select_for_update().filter(id__in=batch)
+                    .filter(~Q(image_count=F('actual_count')) | ~Q(cover_image=F('actual_cover')))
+                    .values_list('id', flat=True)
+                )
+                Vehicle.objects.filter(id__in=stale).update(image_count=actual_count, cover_image=actual_cover)
+                record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.UPDATED, stale)
+                invalidate_vehicle_details(stale)
+            refreshed += len(stale)
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed the image fields of {refreshed} vehicles."))
@@ -53,5 +53,6 @@ class Command(BaseCommand):
                 for img_file in os.listdir(image_folder):
                     with open(f"{image_folder}/{img_file}", 'rb') as f:
                         VehicleImage.objects.create(vehicle=vehicle, image=File(f))
+                vehicle.refresh_image_fields()
 
         self.stdout.write(self.style.SUCCESS("Database seeded successfully!"))
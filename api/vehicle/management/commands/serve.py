@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+import sys
+
+
+class Command(BaseCommand):
+    help = ('Serve the API with gunicorn: the app is loaded and warmed up once, then forked into workers '
+            'that share it copy-on-write (see api/gunicorn_config.py)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', help='Address to listen on, host:port')
+        parser.add_argument('--workers', type=int, help='Number of worker processes')
+
+    def handle(self, *args, **options):
+        try:
+            from gunicorn.app.wsgiapp import WSGIApplication
+        except ImportError:
+            raise CommandError("serve needs gunicorn, install the requirements.")
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        # Gunicorn reads its options from the command line, the configuration file's defaults come first
+        argv = [sys.argv[0], '--config', 'python:api.gunicorn_config']
+        if options['bind']:
+            argv += ['--bind', options['bind']]
+        if options['workers']:
+            argv += ['--workers', str(options['workers'])]
+        sys.argv = argv
+        WSGIApplication("%(prog)s [OPTIONS]").run()
@@ -0,0 +1,47 @@
+from .models import SavedSearch, SearchNotification
+from collections import defaultdict
+
+
+"""
+Saved Search Matching
+=====================
+
+Instead of re-running every saved search when a vehicle is listed, the vehicle is matched against
+the saved searches. Every saved filter is a conjunction of "make is X or any", "model is Y or any",
+"year >= min_year" and "price >= min_price", so the candidate searches come from a lookup on the
+(make, model, min_year, min_price) index, with one query per make/model among the vehicles.
+"""
+
+NOTIFICATION_BATCH_SIZE = 500
+
+
+def notify_saved_searches(vehicles):
+    """Record a notification for every saved search matching one of the new or repriced vehicles."""
+    groups = defaultdict(list)
+    for vehicle in vehicles:
+        groups[(vehicle.make_id, vehicle.model_id)].append(vehicle)
+
+    pending = []
+    for group in groups.values():
+        # Saved searches hold the names, the rows come from the dimension cache
+        candidates = SavedSearch.objects.filter(
+            make__in=[group[0].make.name, ''],
+            model__in=[group[0].model.name, ''],
+            min_year__lte=max(vehicle.year for vehicle in group),
+            min_price__lte=max(vehicle.price for vehicle in group),
+        ).values_list('id', 'user_id', 'min_year', 'min_price')
+
+        for search_id, user_id, min_year, min_price in candidates.iterator(chunk_size=NOTIFICATION_BATCH_SIZE):
+            for vehicle in group:
+                # Sellers are not notified about their own vehicles
+                if vehicle.owner_id == user_id or vehicle.year < min_year or vehicle.price < min_price:
+                    continue
+                pending.append(SearchNotification(saved_search_id=search_id, vehicle_id=vehicle.id))
+
+            if len(pending) >= NOTIFICATION_BATCH_SIZE:
+                SearchNotification.objects.bulk_create(pending, ignore_conflicts=True)
+                pending = []
+
+    # A search that already notified about a vehicle (e.g. on a previous reprice) is skipped
+    if pending:
+        SearchNotification.objects.bulk_create(pending, ignore_conflicts=True)
@@ -1,25 +1,193 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .storage import ContentAddressedStorage, vehicle_image_path
+from .dimensions import DimensionForeignKey, DimensionNamesMixin
 
 
-class Vehicle(models.Model):
+class Dimension(models.Model):
+    # Lookup table row, see dimensions.py
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.name
+
+
+class VehicleMake(Dimension):
+    pass
+
+
+class VehicleModel(Dimension):
+    pass
+
+
+class Color(Dimension):
+    name = models.CharField(max_length=30, unique=True)
+
+
+class FuelType(Dimension):
+    name = models.CharField(max_length=20, unique=True)
+
+
+class Transmission(Dimension):
+    name = models.CharField(max_length=20, unique=True)
+
+
+class VehicleQuerySet(models.QuerySet):
+    def delete(self):
+        # Imported here, deletion.py needs the models
+        from .deletion import deleting_vehicles
+        with deleting_vehicles(self):
+            return super().delete()
+
+
+class Vehicle(DimensionNamesMixin, models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
-    make = models.CharField(max_length=50)
-    model = models.CharField(max_length=50)
+    # Assigned by name, e.g. make='AUDI', the row is looked up or created on save. Filtered by name
+    # with make__name='AUDI'
+    make = DimensionForeignKey(VehicleMake)
+    model = DimensionForeignKey(VehicleModel)
     year = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     mileage = models.PositiveIntegerField()
-    color = models.CharField(max_length=30)
-    fuel_type = models.CharField(max_length=20)
-    transmission = models.CharField(max_length=20)
+    color = DimensionForeignKey(Color)
+    fuel_type = DimensionForeignKey(FuelType)
+    transmission = DimensionForeignKey(Transmission)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized from VehicleImage so list views don't have to touch the images table
+    image_count = models.PositiveSmallIntegerField(default=0)
+    cover_image = models.ImageField(upload_to='vehicle_images/', blank=True)
+
+    objects = VehicleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['make', 'model']), models.Index(fields=['year'])]
 
     def __str__(self):
         return f"{self.make} {self.model}"
 
+    def delete(self, *args, **kwargs):
+        # The change log, counts, caches and media of deleted vehicles are updated in bulk, see deletion.py
+        from .deletion import deleting_vehicles
+        with deleting_vehicles(Vehicle.objects.filter(pk=self.pk)):
+            return super().delete(*args, **kwargs)
+
+    def refresh_image_fields(self):
+        """Recompute image_count and cover_image from the images currently stored."""
+        images = self.images.order_by('created_at', 'id').values_list('image', flat=True)
+        self.image_count = images.count()
+        self.cover_image = images.first() or ''
+        self.save(update_fields=['image_count', 'cover_image'])
+
+
+class ImageBlob(models.Model):
+    # A stored image file, shared by every VehicleImage with the same content
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+
+class VehicleImageQuerySet(models.QuerySet):
+    def delete(self):
+        from .deletion import deleting_images
+        with deleting_images(self):
+            return super().delete()
+
 
 class VehicleImage(models.Model):
     vehicle = models.ForeignKey(Vehicle, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='vehicle_images/')
+    image = models.ImageField(upload_to=vehicle_image_path, storage=ContentAddressedStorage())
+    # Set once the image is counted in its blob, empty for images stored before deduplication
+    blob = models.ForeignKey(ImageBlob, related_name='images', null=True, blank=True, on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = VehicleImageQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # The uploaded content, saving replaces it with the stored name. acquire_blob writes it again
+        # if the stored file was purged in the meantime.
+        self.uploaded_file = self.image.file if self.image and not self.image._committed else None
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # The vehicle's image fields, the blob and the media queue are updated in bulk, see deletion.py
+        from .deletion import deleting_images
+        with deleting_images(VehicleImage.objects.filter(pk=self.pk)):
+            return super().delete(*args, **kwargs)
+
+
+class PendingMediaDeletion(models.Model):
+    # Durable queue of media files whose rows are gone, drained by the purge_media command
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class SavedSearch(models.Model):
+    # Blank make/model and zero bounds mean "any", so matching a vehicle stays a plain indexed lookup
+    user = models.ForeignKey(User, related_name='saved_searches', on_delete=models.CASCADE)
+    make = models.CharField(max_length=50, blank=True)
+    model = models.CharField(max_length=50, blank=True)
+    min_year = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['make', 'model', 'min_year', 'min_price'])]
+
+
+class SearchNotification(models.Model):
+    saved_search = models.ForeignKey(SavedSearch, related_name='notifications', on_delete=models.CASCADE)
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['saved_search', 'vehicle'], name='unique_search_notification'),
+        ]
+
+
+class ChangeLogEntry(models.Model):
+    # The auto-incrementing id is the cursor clients sync from, deletes are kept as tombstones
+    VEHICLE = 'vehicle'
+    IMAGE = 'image'
+    OBJECT_TYPES = [(VEHICLE, 'Vehicle'), (IMAGE, 'Vehicle image')]
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    object_type = models.CharField(max_length=10, choices=OBJECT_TYPES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ChangeLogHorizon(models.Model):
+    # Single row, the highest change log id dropped by the retention period, older cursors may have missed it
+    expired_id = models.BigIntegerField(default=0)
+
+
+class VehicleCount(DimensionNamesMixin, models.Model):
+    # Number of vehicles per make, model and year, kept up to date by signals (see counting.py)
+    make = DimensionForeignKey(VehicleMake)
+    model = DimensionForeignKey(VehicleModel)
+    year = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['make', 'model', 'year'], name='unique_vehicle_count'),
+        ]
+
+
+class ValueHistogram(models.Model):
+    # Equi-depth histogram of a vehicle field, bounds[i] to bounds[i + 1] holds an equal share of the vehicles
+    field = models.CharField(max_length=20, unique=True)
+    bounds = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,61 @@
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import NOT_PROVIDED
+import copy
+
+
+"""
+Schema Upgrades
+===============
+
+The project has no migrations, migrate --run-syncdb creates the missing tables but leaves the columns of
+existing tables alone. The commands that upgrade existing data add the columns they need with these helpers.
+
+An older database is upgraded with, in this order: migrate --run-syncdb, convert_dimensions (which also
+fills the change log and the vehicle counts), refresh_image_fields, dedupe_media, purge_media and
+refresh_counts.
+
+A column is added nullable without a default (a plain ALTER TABLE ADD COLUMN on every backend), filled with
+its default and only then altered to the model's definition. SQLite rebuilds the table for that, copying
+every column the model has, so all other columns have to be there already: a missing one would be copied
+as its quoted name, i.e. a string literal.
+"""
+
+
+def missing_fields(model):
+    """The model's fields that have no column in its table yet."""
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, model._meta.db_table)}
+    return [field for field in model._meta.local_concrete_fields if field.column not in columns]
+
+
+def add_nullable_field(editor, model, field):
+    """Add the field's column as nullable, filled with the default, and return the field it was added as."""
+    nullable = copy.copy(field)
+    nullable.null = True
+    nullable.default = NOT_PROVIDED
+    editor.add_field(model, nullable)
+
+    default = field.get_default()
+    if default is not None:
+        quote = editor.quote_name
+        editor.execute(f"UPDATE {quote(model._meta.db_table)} SET {quote(field.column)} = %s", [default])
+    return nullable
+
+
+def add_missing_fields(model, names):
+    """Add the columns of the named fields missing from the model's table, return the names added."""
+    missing = missing_fields(model)
+    added = [field for field in missing if field.name in names]
+    if not added:
+        return []
+    others = [field.column for field in missing if field.name not in names]
+    if others:
+        raise CommandError(f"{model._meta.db_table} also lacks {', '.join(others)}, run convert_dimensions first.")
+
+    with connection.schema_editor() as editor:
+        nullable = {field: add_nullable_field(editor, model, field) for field in added}
+    with connection.schema_editor() as editor:
+        for field, added_as in nullable.items():
+            editor.alter_field(model, added_as, field)
+    return [field.name for field in added]
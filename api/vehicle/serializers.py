@@ -1,27 +1,67 @@
 from rest_framework import serializers
-from .models import Vehicle, VehicleImage
+from .models import (Vehicle, VehicleImage, SavedSearch, SearchNotification, VehicleMake, VehicleModel, Color,
+                     FuelType, Transmission)
+from .dimensions import dimension_cache
 from user.serializers import UserSerializer
 
+MAX_VEHICLE_IMAGES = 10
+
+
 class VehicleImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = VehicleImage
-        fields = "__all__"
+        # Not the blob, it's internal bookkeeping set by acquire_blob (see blobs.py)
+        fields = ["id", "vehicle", "image", "created_at"]
 
     def validate(self, attrs):
         vehicle = attrs.get('vehicle')
-        if vehicle.images.count() >= 10:
-            raise serializers.ValidationError("You can only upload a maximum of 10 images.")
+        # image_count is kept in sync by VehicleImageView, which locks the vehicle row first
+        if vehicle.image_count >= MAX_VEHICLE_IMAGES:
+            raise serializers.ValidationError(f"You can only upload a maximum of {MAX_VEHICLE_IMAGES} images.")
         return attrs
 
 
-class VehicleSerializer(serializers.ModelSerializer):
+class DimensionField(serializers.CharField):
+    """
+    A dimension (make, model, ...) as its name. Written as the name, which the model field resolves, and
+    read from the id through the dimension cache, so serializing vehicles doesn't touch the lookup tables.
+    """
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+        kwargs.setdefault('max_length', model._meta.get_field('name').max_length)
+        super().__init__(**kwargs)
+        # Rows loaded while serializing, used until they are in the process cache
+        self.rows = {}
+
+    def get_attribute(self, instance):
+        return getattr(instance, f"{self.source}_id")
+
+    def to_representation(self, pk):
+        row = dimension_cache(self.model).rows.get(pk) or self.rows.get(pk)
+        if row is None:
+            self.rows = dimension_cache(self.model).load()
+            row = self.rows[pk]
+        return row.name
+
+
+class VehicleDimensionsSerializer(serializers.ModelSerializer):
+    make = DimensionField(VehicleMake)
+    model = DimensionField(VehicleModel)
+    color = DimensionField(Color)
+    fuel_type = DimensionField(FuelType)
+    transmission = DimensionField(Transmission)
+
+
+class VehicleSerializer(VehicleDimensionsSerializer):
     images = VehicleImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Vehicle
         fields = ["id", "make", "model", "year", "price", "mileage", "color", "fuel_type", 
-                  "transmission", "description", "created_at", "owner", "images"]
-        
+                  "transmission", "description", "created_at", "owner", "image_count", "cover_image", "images"]
+        read_only_fields = ["image_count", "cover_image"]
+
     def validate(self, attrs):
         # Convert string fields to uppercase
         if 'make' in attrs:
@@ -45,22 +85,69 @@ class VehicleSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class VehicleDetailSerializer(serializers.ModelSerializer):
+class VehicleListSerializer(VehicleDimensionsSerializer):
+    # Compact representation for list cards: only the cover image instead of the nested images
+    class Meta:
+        model = Vehicle
+        fields = ["id", "make", "model", "year", "price", "mileage", "color", "fuel_type",
+                  "transmission", "created_at", "owner", "image_count", "cover_image"]
+        read_only_fields = fields
+
+
+class VehicleDetailSerializer(VehicleDimensionsSerializer):
     images = VehicleImageSerializer(many=True, read_only=True)
     owner = UserSerializer(read_only=True)
 
     class Meta:
         model = Vehicle
         fields = "__all__"
+        read_only_fields = ["image_count", "cover_image"]
+
+
+class VehicleMakeSerializer(serializers.Serializer):
+    make = serializers.CharField()
+
 
+class VehicleModelSerializer(serializers.Serializer):
+    model = serializers.CharField()
+
+
+BULK_UPDATE_FIELDS = ["price", "mileage", "description"]
+MAX_BULK_ITEMS = 500
+
+
+class VehicleBulkUpdateSerializer(serializers.ModelSerializer):
+    # Writable id, it identifies the vehicle the changes apply to
+    id = serializers.IntegerField()
 
-class VehicleMakeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vehicle
-        fields = ['make']
+        fields = ["id"] + BULK_UPDATE_FIELDS
+        extra_kwargs = {field: {'required': False} for field in BULK_UPDATE_FIELDS}
+
 
+class VehicleBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=MAX_BULK_ITEMS)
 
-class VehicleModelSerializer(serializers.ModelSerializer):
+
+class SavedSearchSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Vehicle
-        fields = ['model']
+        model = SavedSearch
+        fields = ["id", "make", "model", "min_year", "min_price", "created_at"]
+
+    def validate(self, attrs):
+        # Vehicles are stored in uppercase, the saved filters have to match exactly
+        if 'make' in attrs:
+            attrs['make'] = attrs['make'].upper()
+        if 'model' in attrs:
+            attrs['model'] = attrs['model'].upper()
+
+        return attrs
+
+
+class SearchNotificationSerializer(serializers.ModelSerializer):
+    vehicle = VehicleListSerializer(read_only=True)
+
+    class Meta:
+        model = SearchNotification
+        fields = ["id", "saved_search", "vehicle", "created_at"]
@@ -0,0 +1,81 @@
+from django.db.models.signals import pre_save, post_save, pre_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+from .models import Vehicle, VehicleImage, ChangeLogEntry
+from .blobs import acquire_blob
+from .changes import record_changes
+from .catalog import invalidate_catalog, invalidate_vehicle_details
+from .live import publish_vehicle_changes
+from .counting import COUNTED_FIELDS, adjust_counts, count_key
+
+
+@receiver(post_save, sender=VehicleImage)
+def reference_image_blob(sender, instance, created, **kwargs):
+    if created and instance.image:
+        acquire_blob(instance)
+
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=VehicleImage)
+def record_saved(sender, instance, created, **kwargs):
+    object_type = ChangeLogEntry.VEHICLE if sender is Vehicle else ChangeLogEntry.IMAGE
+    action = ChangeLogEntry.CREATED if created else ChangeLogEntry.UPDATED
+    record_changes(object_type, action, [instance.pk])
+
+
+@receiver(post_save, sender=Vehicle)
+def invalidate_vehicle_catalog(sender, instance, **kwargs):
+    invalidate_catalog(instance.make.name)
+
+
+@receiver(post_save, sender=Vehicle)
+def invalidate_vehicle_detail(sender, instance, **kwargs):
+    invalidate_vehicle_details([instance.pk])
+
+
+@receiver(post_save, sender=Vehicle)
+def publish_saved_vehicle(sender, instance, created, **kwargs):
+    publish_vehicle_changes('created' if created else 'updated', [instance])
+
+
+def counts_touched(update_fields):
+    return update_fields is None or bool(COUNTED_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Vehicle)
+def remember_counted_key(sender, instance, update_fields=None, **kwargs):
+    # The make, model and year the vehicle is counted under before the save
+    if instance.pk and counts_touched(update_fields):
+        instance._counted_key = (Vehicle.objects.filter(pk=instance.pk)
+                                 .values_list('make_id', 'model_id', 'year').first())
+
+
+@receiver(post_save, sender=Vehicle)
+def count_saved_vehicle(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        adjust_counts({count_key(instance): 1})
+    elif counts_touched(update_fields):
+        old_key = getattr(instance, '_counted_key', None)
+        new_key = count_key(instance)
+        if old_key is not None and old_key != new_key:
+            adjust_counts({old_key: -1, new_key: 1})
+
+
+@receiver(post_save, sender=VehicleImage)
+def invalidate_image_vehicle_detail(sender, instance, **kwargs):
+    invalidate_vehicle_details([instance.vehicle_id])
+
+
+@receiver(post_save, sender=User)
+def invalidate_owner_vehicle_details(sender, instance, update_fields=None, **kwargs):
+    # The owner is part of the detail representation, a login only touches last_login though
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_vehicle_details(Vehicle.objects.filter(owner_id=instance.pk).values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def delete_owner_vehicles(sender, instance, **kwargs):
+    # Vehicles and images have no delete signals (see deletion.py), the user's vehicles are deleted in bulk
+    # inside the user's delete transaction, the cascade then finds none left
+    Vehicle.objects.filter(owner_id=instance.pk).delete()
@@ -0,0 +1,81 @@
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from hashlib import sha256
+from uuid import uuid4
+import os
+import re
+
+
+"""
+Content Addressed Storage
+=========================
+
+Vehicle images are stored under the SHA-256 of their content. A name therefore never changes content,
+which lets browsers and CDNs cache image URLs forever, and uploading the same file twice stores it once.
+Uploads are hashed by the upload handlers while they stream in, so they aren't read a second time.
+"""
+
+CONTENT_HASH_NAME = re.compile(r'[0-9a-f]{64}(\.\w+)?')
+
+
+def content_hash(file):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    hasher = sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def vehicle_image_path(instance, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    digest = getattr(instance.image.file, 'sha256', None) or content_hash(instance.image)
+    return f"vehicle_images/{digest}{extension}"
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        # Set first, the parent raises StopFutureHandlers once it takes the file
+        self.hasher = sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        self.hasher = sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The same name means the same content, an existing file is reused rather than renamed
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+
+        # Written under a temporary name and moved in place, so a concurrent upload of the same
+        # content never exposes a partially written file
+        temp_name = super()._save(f"{name}.{uuid4().hex}.tmp", content)
+        os.replace(self.path(temp_name), self.path(name))
+        return name
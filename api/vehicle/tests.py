@@ -1,9 +1,31 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import Vehicle, VehicleImage
+from .models import (Vehicle, VehicleImage, PendingMediaDeletion, SavedSearch, SearchNotification, ChangeLogEntry,
+                     ImageBlob, VehicleMake, VehicleCount, ValueHistogram)
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
+from rest_framework.authtoken.models import Token
+from io import StringIO
+import tempfile
 from django.contrib.auth.models import User
-import os, glob
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, models
+from django.test import TransactionTestCase, override_settings
+from django.apps.registry import Apps
+from django.core.cache import cache
+from django.conf import settings
+from api.throttling import ScopedTokenBucketThrottle, reset_bucket_stores
+from api.profiling import rotate_captures
+from asgiref.sync import sync_to_async
+from .live import hub, DROPPED
+from .dimensions import clear_dimension_caches
+from .catalog import detail_cache_key, MAKES_CACHE_KEY
+from .storage import ContentAddressedStorage
+from . import counting
+from unittest import mock
+import asyncio, json, os, glob
 
 
 class VehicleViewTests(APITestCase):
@@ -14,6 +36,7 @@ class VehicleViewTests(APITestCase):
     """
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpass')
 
         # Create a Mercedes-Benz vehicle for testing
@@ -45,6 +68,7 @@ class VehicleViewTests(APITestCase):
         for file in image_files:
             if not file.endswith("test_car.png"):
                 os.remove(file)
+        super().tearDownClass()
 
     def test_get_all_vehicles(self):
         response = self.client.get(reverse('VehicleList'))
@@ -56,6 +80,65 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['id'], self.vehicle.id)
 
+    def test_vehicle_reads_throttled_apart_from_writes(self):
+        # Full buckets, not drained by the other tests' requests
+        reset_bucket_stores()
+        rates = {'anon': '300/min', 'user': '1000/min', 'vehicles': '1/min'}
+        url = reverse('VehicleDetailUpdateDelete', args=[self.vehicle.id])
+        self.client.force_authenticate(user=self.user)
+        with mock.patch.object(ScopedTokenBucketThrottle, 'THROTTLE_RATES', rates):
+            self.assertEqual(self.client.put(url, {'price': 30000}).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(VEHICLE_DETAIL_CACHE=True)
+    def test_get_vehicle_batch(self):
+        others = self.create_vehicles(self.user, 3)
+        ids = [others[2].id, self.vehicle.id, 99999, others[0].id]
+        response = self.client.get(reverse('VehicleBatch'), {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [others[2].id, self.vehicle.id, others[0].id])
+        self.assertEqual(response.data['missing'], [99999])
+        self.assertEqual(response.data['vehicles'][1]['owner']['id'], self.user.id)
+
+        # Served from the cache the second time, only the missing id is looked up again
+        with self.assertNumQueries(1):
+            self.client.get(reverse('VehicleBatch'), {'ids': ','.join(map(str, ids))})
+
+    def test_get_vehicle_batch_constant_queries(self):
+        ids = [vehicle.id for vehicle in self.create_vehicles(self.user, 10)]
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('VehicleBatch'), {'ids': ','.join(map(str, ids[:2]))})
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('VehicleBatch'), {'ids': ','.join(map(str, ids[2:]))})
+        self.assertEqual(len(few), len(many))
+
+        response = self.client.get(reverse('VehicleBatch'), {'ids': 'a,b'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_single_vehicle_uncached_without_shared_cache(self):
+        # The default cache is per process, another worker couldn't invalidate the entry
+        self.client.get(reverse('VehicleDetailUpdateDelete', args=[self.vehicle.id]))
+        self.assertIsNone(cache.get(detail_cache_key(self.vehicle.id)))
+
+    @override_settings(VEHICLE_DETAIL_CACHE=True)
+    def test_get_single_vehicle_cache_invalidated(self):
+        url = reverse('VehicleDetailUpdateDelete', args=[self.vehicle.id])
+        self.client.get(url)
+        self.client.force_authenticate(user=self.user)
+        self.addCleanup(clear_dimension_caches)
+        # Deleted right away and again on commit, after a read that cached the old representation meanwhile
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(url, {'price': 30000})
+            self.assertIsNone(cache.get(detail_cache_key(self.vehicle.id)))
+            cache.set(detail_cache_key(self.vehicle.id), {'price': '35000.00'})
+        self.assertEqual(self.client.get(url).data['price'], '30000.00')
+
+        self.user.first_name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(url).data['owner']['first_name'], 'Renamed')
+
     def test_create_vehicle(self):
         # Create a new vehicle
         data = {
@@ -73,6 +156,34 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Vehicle.objects.count(), 2)
 
+    def test_vehicle_dimensions_shared(self):
+        self.client.force_authenticate(user=self.user)
+        data = {'make': 'Mercedes-Benz', 'model': 'c-class', 'year': 2019, 'price': 22000, 'mileage': 1000,
+                'color': 'Black', 'fuel_type': 'Petrol', 'transmission': 'Automatic'}
+        response = self.client.post(reverse('VehicleList'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['make'], 'MERCEDES-BENZ')
+        self.assertEqual(response.data['fuel_type'], 'PETROL')
+
+        vehicle = Vehicle.objects.get(pk=response.data['id'])
+        self.assertEqual((vehicle.make_id, vehicle.model_id), (self.vehicle.make_id, self.vehicle.model_id))
+        self.assertEqual(VehicleMake.objects.count(), 1)
+
+    def test_vehicle_dimension_names_resolved_on_save(self):
+        # Assigning names doesn't touch the lookup tables, the rows are created when the vehicle is saved
+        with self.assertNumQueries(0):
+            vehicle = Vehicle(owner=self.user, make='SKODA', model='OCTAVIA', year=2020, price=18000, mileage=40000,
+                              color='WHITE', fuel_type='DIESEL', transmission='MANUAL')
+        self.assertEqual(vehicle.make.name, 'SKODA')
+        self.assertFalse(VehicleMake.objects.filter(name='SKODA').exists())
+
+        vehicle.save()
+        self.assertEqual(Vehicle.objects.get(make__name='SKODA', model__name='OCTAVIA'), vehicle)
+        bulk = Vehicle(owner=self.user, make='SKODA', model='FABIA', year=2019, price=9000, mileage=90000,
+                       color='WHITE', fuel_type='PETROL', transmission='MANUAL')
+        Vehicle.objects.bulk_create([bulk])
+        self.assertEqual(Vehicle.objects.filter(make=vehicle.make).count(), 2)
+
     def test_update_vehicle(self):
         data = {
             'model': 'E-CLASS',
@@ -82,7 +193,7 @@ class VehicleViewTests(APITestCase):
         response = self.client.put(reverse('VehicleDetailUpdateDelete', args=[self.vehicle.id]), data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.vehicle.refresh_from_db()
-        self.assertEqual(self.vehicle.model, 'E-CLASS')
+        self.assertEqual(self.vehicle.model.name, 'E-CLASS')
         self.assertEqual(self.vehicle.price, 36000.00)
 
     def test_update_vehicle_owner(self):
@@ -117,6 +228,181 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+    """
+    Test Vehicle Bulk API
+    =====================
+    """
+
+    def create_vehicles(self, owner, count):
+        return [
+            Vehicle.objects.create(owner=owner, make='AUDI', model='A4', year=2016, price=28000, mileage=60000,
+                                   color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+            for _ in range(count)
+        ]
+
+    def test_bulk_update_vehicles(self):
+        other_user = User.objects.create_user(username='otheruser', password='otherpass')
+        foreign = self.create_vehicles(other_user, 1)[0]
+        data = {'vehicles': [
+            {'id': self.vehicle.id, 'price': 30000, 'mileage': 16000},
+            {'id': foreign.id, 'price': 1},
+            {'id': self.vehicle.id + 1000, 'price': 1},
+            {'id': self.vehicle.id, 'mileage': -5},
+        ]}
+        self.client.force_authenticate(user=self.user)
+        response = self.client.put(reverse('VehicleBulkUpdateDelete'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['results']], ['updated', 'not_allowed', 'not_allowed', 'invalid'])
+
+        self.vehicle.refresh_from_db()
+        foreign.refresh_from_db()
+        self.assertEqual(self.vehicle.price, 30000)
+        self.assertEqual(self.vehicle.mileage, 16000)
+        self.assertEqual(foreign.price, 28000)
+
+    def test_bulk_update_constant_queries(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse('VehicleBulkUpdateDelete')
+
+        def query_count(vehicles):
+            data = {'vehicles': [{'id': v.id, 'price': 1000} for v in vehicles]}
+            with CaptureQueriesContext(connection) as queries:
+                self.client.put(url, data, format='json')
+            return len(queries)
+
+        self.assertEqual(query_count(self.create_vehicles(self.user, 2)), query_count(self.create_vehicles(self.user, 20)))
+
+    def test_bulk_delete_vehicles(self):
+        other_user = User.objects.create_user(username='otheruser', password='otherpass')
+        foreign = self.create_vehicles(other_user, 1)[0]
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('VehicleBulkUpdateDelete'), {'ids': [self.vehicle.id, foreign.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['results']], ['deleted', 'not_allowed'])
+        self.assertFalse(Vehicle.objects.filter(id=self.vehicle.id).exists())
+        self.assertTrue(Vehicle.objects.filter(id=foreign.id).exists())
+
+    def test_bulk_unauthorized(self):
+        response = self.client.delete(reverse('VehicleBulkUpdateDelete'), {'ids': [self.vehicle.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    """
+    Test Vehicle Changes
+    ====================
+    """
+
+    def test_get_vehicle_changes(self):
+        response = self.client.get(reverse('VehicleChanges'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [self.vehicle.id])
+        self.assertEqual([i['id'] for i in response.data['images']], [self.img_response.data['id']])
+        cursor = response.data['cursor']
+
+        # Nothing changed since the cursor
+        response = self.client.get(reverse('VehicleChanges'), {'since': cursor})
+        self.assertEqual(response.data['cursor'], cursor)
+        self.assertEqual(response.data['vehicles'], [])
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('VehicleImageDelete', args=[self.img_response.data['id']]))
+        response = self.client.get(reverse('VehicleChanges'), {'since': cursor})
+        self.assertEqual(response.data['deleted']['images'], [self.img_response.data['id']])
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [self.vehicle.id])
+
+    def test_get_vehicle_changes_paginated(self):
+        response = self.client.get(reverse('VehicleChanges'), {'limit': 1})
+        self.assertTrue(response.data['has_more'])
+        response = self.client.get(reverse('VehicleChanges'), {'since': response.data['cursor'], 'limit': 100})
+        self.assertFalse(response.data['has_more'])
+
+    def test_compact_changes(self):
+        cursor = ChangeLogEntry.objects.order_by('id').first().id
+        self.vehicle.save()
+        self.vehicle.save()
+        VehicleImage.objects.get().save()
+        call_command('compact_changes', stdout=StringIO())
+        # Superseded entries are dropped, one entry per vehicle and image is left
+        self.assertEqual(ChangeLogEntry.objects.count(), 2)
+        # The newest entry of every object is still there, so the cursor is still good
+        response = self.client.get(reverse('VehicleChanges'), {'since': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [self.vehicle.id])
+
+        self.vehicle.delete()
+        call_command('compact_changes', '--days=0', stdout=StringIO())
+        # Only the newest entry survives the retention period of 0 days
+        self.assertEqual(ChangeLogEntry.objects.count(), 1)
+
+        response = self.client.get(reverse('VehicleChanges'), {'since': cursor})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_get_vehicle_snapshot(self):
+        others = self.create_vehicles(self.user, 2)
+        others[0].delete()
+        call_command('compact_changes', '--days=0', stdout=StringIO())
+
+        # Bootstrapping from the start would miss the dropped entries
+        response = self.client.get(reverse('VehicleChanges'), {'since': 0})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        response = self.client.get(reverse('VehicleSnapshot'), {'limit': 1})
+        cursor = response.data['cursor']
+        self.assertTrue(response.data['has_more'])
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [self.vehicle.id])
+        self.assertEqual(len(response.data['vehicles'][0]['images']), 1)
+
+        # A change made while paging comes with the sync from the first page's cursor
+        others[1].save()
+        response = self.client.get(reverse('VehicleSnapshot'), {'after': response.data['after']})
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [others[1].id])
+
+        response = self.client.get(reverse('VehicleChanges'), {'since': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [others[1].id])
+
+
+    """
+    Test Saved Searches
+    ===================
+    """
+
+    def test_saved_search_notifications(self):
+        buyer = User.objects.create_user(username='buyer', password='buyerpass')
+        self.client.force_authenticate(user=buyer)
+        response = self.client.post(reverse('SavedSearchList'), {'make': 'audi', 'min_price': 20000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['make'], 'AUDI')
+        SavedSearch.objects.create(user=buyer, make='AUDI', model='A6')
+        SavedSearch.objects.create(user=buyer, min_year=2020)
+        # Sellers are not notified about their own listings
+        SavedSearch.objects.create(user=self.user, make='AUDI')
+
+        self.client.force_authenticate(user=self.user)
+        data = {'make': 'Audi', 'model': 'A4', 'year': 2016, 'price': 28000, 'mileage': 60000,
+                'color': 'Silver', 'fuel_type': 'Diesel', 'transmission': 'Manual'}
+        self.client.post(reverse('VehicleList'), data, format='json')
+        self.assertEqual(SearchNotification.objects.count(), 1)
+
+        # A cheap reprice drops below min_price, the 2020+ search still doesn't match the year
+        vehicle = Vehicle.objects.get(make__name='AUDI')
+        self.client.put(reverse('VehicleDetailUpdateDelete', args=[vehicle.id]), {'price': 10000})
+        self.assertEqual(SearchNotification.objects.count(), 1)
+
+        self.client.force_authenticate(user=buyer)
+        response = self.client.get(reverse('SearchNotifications'))
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['vehicle']['id'], vehicle.id)
+
+    def test_delete_saved_search_not_owner(self):
+        saved_search = SavedSearch.objects.create(user=self.user, make='AUDI')
+        other_user = User.objects.create_user(username='otheruser', password='otherpass')
+        self.client.force_authenticate(user=other_user)
+        response = self.client.delete(reverse('SavedSearchDelete', args=[saved_search.id]))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
     """
     Test Vehicle Image API
     ======================
@@ -156,10 +442,189 @@ class VehicleViewTests(APITestCase):
         response = self.client.delete(reverse('VehicleImageDelete', args=[self.img_response.data['id']]))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_delete_image_purges_file(self):
+        path = VehicleImage.objects.get(id=self.img_response.data['id']).image.name
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('VehicleImageDelete', args=[self.img_response.data['id']]))
+        self.assertTrue(PendingMediaDeletion.objects.filter(path=path).exists())
+        self.assertTrue(default_storage.exists(path))
+
+        call_command('purge_media', stdout=StringIO())
+        self.assertFalse(default_storage.exists(path))
+        self.assertFalse(PendingMediaDeletion.objects.exists())
+
+    def test_delete_vehicle_queues_image_files(self):
+        path = VehicleImage.objects.get(id=self.img_response.data['id']).image.name
+        self.user.delete()
+        self.assertTrue(PendingMediaDeletion.objects.filter(path=path).exists())
+
+    def test_delete_user_constant_queries(self):
+        def delete_seller(username, vehicles):
+            seller = User.objects.create_user(username=username, password='sellerpass')
+            for vehicle in self.create_vehicles(seller, vehicles):
+                for _ in range(5):
+                    VehicleImage.objects.create(vehicle=vehicle, image=ContentFile(b'image', name='car.png'))
+            with CaptureQueriesContext(connection) as queries:
+                seller.delete()
+            return len(queries)
+
+        self.assertEqual(delete_seller('small', 2), delete_seller('large', 20))
+        self.assertFalse(VehicleImage.objects.exclude(vehicle=self.vehicle).exists())
+        self.assertEqual(ChangeLogEntry.objects.filter(action=ChangeLogEntry.DELETED).count(), 22 * 6)
+
+    def test_reconcile_media(self):
+        orphan = default_storage.save('vehicle_images/orphan.png', ContentFile(b'orphan'))
+        referenced = VehicleImage.objects.get(id=self.img_response.data['id']).image.name
+        try:
+            call_command('reconcile_media', '--grace-minutes=0', '--enqueue', stdout=StringIO())
+            queued = set(PendingMediaDeletion.objects.values_list('path', flat=True))
+            self.assertIn(orphan, queued)
+            self.assertNotIn(referenced, queued)
+        finally:
+            default_storage.delete(orphan)
+
     def test_delete_image_unauthorized(self):
         response = self.client.delete(reverse('VehicleImageDelete', args=[self.img_response.data['id']]))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_image_content_addressed(self):
+        name = VehicleImage.objects.get(id=self.img_response.data['id']).image.name
+        self.assertRegex(name, r'^vehicle_images/[0-9a-f]{64}\.png$')
+
+        # The same content is stored once, under the same name
+        self.client.force_authenticate(user=self.user)
+        with open('./media/vehicle_images/test_car.png', 'rb') as img:
+            response = self.client.post(reverse('VehicleImageCreate'), {'vehicle': self.vehicle.id, 'image': img}, format='multipart')
+        self.assertEqual(VehicleImage.objects.get(id=response.data['id']).image.name, name)
+
+    def test_image_blob_reference_count(self):
+        image = VehicleImage.objects.get(id=self.img_response.data['id'])
+        other = Vehicle.objects.create(owner=self.user, make='AUDI', model='A4', year=2016, price=28000, mileage=60000,
+                                       color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+        self.client.force_authenticate(user=self.user)
+        with open('./media/vehicle_images/test_car.png', 'rb') as img:
+            response = self.client.post(reverse('VehicleImageCreate'), {'vehicle': other.id, 'image': img}, format='multipart')
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.name, image.image.name)
+
+        # The file stays until its last reference is gone
+        self.client.delete(reverse('VehicleImageDelete', args=[image.id]))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertFalse(PendingMediaDeletion.objects.exists())
+
+        self.client.delete(reverse('VehicleImageDelete', args=[response.data['id']]))
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertTrue(PendingMediaDeletion.objects.filter(path=blob.name).exists())
+
+    def test_upload_restores_purged_file(self):
+        image = VehicleImage.objects.get(id=self.img_response.data['id'])
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('VehicleImageDelete', args=[image.id]))
+
+        # The upload finds the queued file still stored, then purge_media removes it before the upload commits
+        save = ContentAddressedStorage._save
+        def save_then_purge(storage, name, content):
+            name = save(storage, name, content)
+            call_command('purge_media', stdout=StringIO())
+            return name
+
+        with mock.patch.object(ContentAddressedStorage, '_save', save_then_purge):
+            with open('./media/vehicle_images/test_car.png', 'rb') as img:
+                response = self.client.post(reverse('VehicleImageCreate'), {'vehicle': self.vehicle.id, 'image': img}, format='multipart')
+        self.assertNotIn('blob', response.data)
+        self.assertEqual(response.data['image'], image.image.url)
+        self.assertTrue(default_storage.exists(image.image.name))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+    def test_dedupe_media(self):
+        image = VehicleImage.objects.get(id=self.img_response.data['id'])
+        with open('./media/vehicle_images/test_car.png', 'rb') as img:
+            legacy = default_storage.save('vehicle_images/legacy_car.png', img)
+        try:
+            # Stored before deduplication: bulk_create skips the signals that count blob references
+            VehicleImage.objects.bulk_create([VehicleImage(vehicle=self.vehicle, image=legacy)])
+            call_command('dedupe_media', stdout=StringIO())
+
+            self.assertEqual(set(VehicleImage.objects.values_list('image', flat=True)), {image.image.name})
+            self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+            self.assertTrue(PendingMediaDeletion.objects.filter(path=legacy).exists())
+        finally:
+            default_storage.delete(legacy)
+
+    def test_serve_media_caching(self):
+        name = VehicleImage.objects.get(id=self.img_response.data['id']).image.name
+        url = reverse('Media', args=[name])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # If-None-Match uses the weak comparison
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(len(b''.join(response.streaming_content)), 10)
+        self.assertTrue(response['Content-Range'].startswith('bytes 0-9/'))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=99999999-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        # Multiple and malformed ranges aren't supported, they are ignored
+        for header in ['bytes=0-1,5-6', 'bytes=9-0', 'items=0-9', 'bytes=x-']:
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, header)
+            self.assertNotIn('Content-Range', response)
+
+        # Files that aren't content addressed are revalidated
+        response = self.client.get(reverse('Media', args=['vehicle_images/test_car.png']))
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.client.get(reverse('Media', args=['../manage.py'])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_image_count_and_cover_image(self):
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.image_count, 1)
+        self.assertEqual(self.vehicle.cover_image.name, VehicleImage.objects.get().image.name)
+
+        # The list representation only carries the cover image
+        response = self.client.get(reverse('VehicleList'))
+        self.assertNotIn('images', response.data[0])
+        self.assertTrue(response.data[0]['cover_image'].endswith(self.vehicle.cover_image.name))
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('VehicleImageDelete', args=[self.img_response.data['id']]))
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.image_count, 0)
+        self.assertEqual(self.vehicle.cover_image.name, '')
+
+    def test_refresh_image_fields(self):
+        other = self.create_vehicles(self.user, 1)[0]
+        Vehicle.objects.filter(id=self.vehicle.id).update(image_count=0, cover_image='')
+        ChangeLogEntry.objects.all().delete()
+        out = StringIO()
+        call_command('refresh_image_fields', stdout=out)
+
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.image_count, 1)
+        self.assertEqual(self.vehicle.cover_image.name, VehicleImage.objects.get().image.name)
+        self.assertIn('Refreshed the image fields of 1 vehicles', out.getvalue())
+        # The vehicle that was right isn't logged
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('object_id', flat=True)), [self.vehicle.id])
+        self.assertEqual(Vehicle.objects.get(id=other.id).image_count, 0)
+
+    def test_create_image_limit(self):
+        Vehicle.objects.filter(id=self.vehicle.id).update(image_count=10)
+        self.client.force_authenticate(user=self.user)
+        with open('./media/vehicle_images/test_car.png', 'rb') as img:
+            response = self.client.post(reverse('VehicleImageCreate'), {'vehicle': self.vehicle.id, 'image': img}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_delete_image_not_vehicle_owner(self):        
         other_user = User.objects.create_user(username='otheruser', password='otherpass')
         self.client.force_authenticate(user=other_user)
@@ -185,6 +650,30 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['id'], self.vehicle.id)
 
+    def test_get_vehicle_by_fuzzy_make_and_model(self):
+        golf = Vehicle.objects.create(owner=self.user, make='VOLKSWAGEN', model='GOLF 8', year=2021, price=25000,
+                                      mileage=20000, color='Blue', fuel_type='Petrol', transmission='Manual')
+        searches = [
+            ({'make': 'mercedes'}, [self.vehicle.id]),
+            ({'make': 'mercedez-benz', 'model': 'c-clas'}, [self.vehicle.id]),
+            ({'make': 'vw golf'}, [golf.id]),
+            ({'make': 'volkswagn', 'model': 'golf'}, [golf.id]),
+            ({'make': 'bmw'}, []),
+        ]
+        for params, expected in searches:
+            response = self.client.get(reverse('SearchVehicle'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([vehicle['id'] for vehicle in response.data], expected, params)
+
+    def test_get_vehicle_missing_from_cached_catalog(self):
+        # The catalog is cached before the vehicle is listed, and not invalidated as nothing commits here
+        self.client.get(reverse('GetVehicleMakes'))
+        skoda = Vehicle.objects.create(owner=self.user, make='SKODA', model='OCTAVIA', year=2020, price=18000,
+                                       mileage=40000, color='White', fuel_type='Diesel', transmission='Manual')
+        for params in [{'make': 'SKODA'}, {'make': 'skoda', 'model': 'octavia'}, {'model': 'OCTAVIA'}]:
+            response = self.client.get(reverse('SearchVehicle'), params)
+            self.assertEqual([vehicle['id'] for vehicle in response.data], [skoda.id], params)
+
     def test_get_vehicle_by_year(self):
         response = self.client.get(reverse('SearchVehicle'), {'year': 2022})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -203,10 +692,68 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['id'], self.vehicle.id)
 
+    def test_vehicle_counts_maintained(self):
+        def audi_counts():
+            return dict(VehicleCount.objects.filter(make__name='AUDI').values_list('year', 'count'))
+
+        audis = self.create_vehicles(self.user, 3)
+        self.assertEqual(audi_counts(), {2016: 3})
+
+        audis[0].year = 2018
+        audis[0].save()
+        audis[1].price = 1000
+        audis[1].save(update_fields=['price'])
+        self.assertEqual(audi_counts(), {2016: 2, 2018: 1})
+
+        audis[2].delete()
+        self.assertEqual(audi_counts(), {2016: 1, 2018: 1})
+
+    def test_get_vehicle_count(self):
+        self.create_vehicles(self.user, 4)
+        searches = [
+            ({}, 5),
+            ({'make': 'audi', 'year': 2016}, 4),
+            ({'make': 'mercedes', 'price': 35000}, 1),
+            ({'mileage': 20000}, 1),
+            ({'make': 'bmw'}, 0),
+        ]
+        for params, expected in searches:
+            response = self.client.get(reverse('SearchVehicleCount'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {'count': expected, 'exact': True}, params)
+
+    def test_get_vehicle_count_estimated(self):
+        self.create_vehicles(self.user, 4)
+        call_command('refresh_counts', stdout=StringIO())
+        with mock.patch.object(counting, 'COUNT_EXACT_LIMIT', 2):
+            # Four Audis priced 28000 and one Mercedes priced 35000, the histogram puts a fifth above 30000
+            response = self.client.get(reverse('SearchVehicleCount'), {'make': 'audi'})
+            self.assertEqual(response.data, {'count': 4, 'exact': False})
+            response = self.client.get(reverse('SearchVehicleCount'), {'price': 30000})
+            self.assertEqual(response.data, {'count': 1, 'exact': True})
+
+            # Without a histogram the count stops past the limit
+            ValueHistogram.objects.all().delete()
+            response = self.client.get(reverse('SearchVehicleCount'), {'mileage': 100000})
+            self.assertEqual(response.data, {'count': 3, 'exact': False})
+
     def test_get_all_vehicle_makes(self):
         response = self.client.get(reverse('GetVehicleMakes'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_vehicle_makes_cache_invalidated(self):
+        self.client.get(reverse('GetVehicleMakes'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('GetVehicleMakes'))
+
+        self.addCleanup(clear_dimension_caches)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_vehicles(self.user, 1)
+            self.assertIsNone(cache.get(MAKES_CACHE_KEY))
+            cache.set(MAKES_CACHE_KEY, [{'make': 'MERCEDES-BENZ'}])
+        response = self.client.get(reverse('GetVehicleMakes'))
+        self.assertEqual([m['make'] for m in response.data], ['AUDI', 'MERCEDES-BENZ'])
+
     def test_get_vehicle_models_invalid_make(self):
         response = self.client.get(reverse('GetVehicleModels', kwargs={'requested_make': 'INVALID_MAKE'}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -216,3 +763,261 @@ class VehicleViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['model'], 'C-CLASS') 
+
+
+class LiveFeedTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        # The commit callbacks run below also cache the dimension rows, which are rolled back after the test
+        self.addCleanup(clear_dimension_caches)
+
+    def create_vehicle(self, make, price):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Vehicle.objects.create(owner=self.user, make=make, model='A4', year=2016, price=price,
+                                          mileage=60000, color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+
+    async def next_event(self, stream):
+        return await asyncio.wait_for(anext(stream), 5)
+
+    async def test_live_feed(self):
+        response = await self.async_client.get(reverse('VehicleLiveFeed'), {'make': 'audi', 'max_price': 30000})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await self.next_event(stream), b'retry: 3000\n\n')
+
+        # Only the vehicle matching the filters is pushed
+        await sync_to_async(self.create_vehicle)('BMW', 20000)
+        await sync_to_async(self.create_vehicle)('AUDI', 40000)
+        audi = await sync_to_async(self.create_vehicle)('AUDI', 20000)
+        event = await self.next_event(stream)
+        self.assertTrue(event.startswith(b'event: created\n'))
+        self.assertEqual(json.loads(event.split(b'data: ', 1)[1])['id'], audi.id)
+
+        # A disconnect cancels the pending read, which unsubscribes the client
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(hub.subscribers, set())
+
+    async def test_live_feed_drops_slow_consumers(self):
+        subscriber = hub.subscribe(make='AUDI')
+        try:
+            vehicles = [{'id': i, 'make': 'AUDI', 'model': 'A4', 'price': '1000.00'} for i in range(settings.LIVE_BUFFER_SIZE + 1)]
+            hub.publish('created', vehicles)
+            self.assertIs(await asyncio.wait_for(subscriber.queue.get(), 5), DROPPED)
+            self.assertTrue(subscriber.queue.empty())
+        finally:
+            hub.unsubscribe(subscriber)
+
+    def test_live_feed_requires_asgi(self):
+        response = self.client.get(reverse('VehicleLiveFeed'))
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class VehicleAdminTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_login(self.admin)
+        self.vehicles = []
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = self.settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def create_vehicles(self, count):
+        self.vehicles += Vehicle.objects.bulk_create(
+            Vehicle(owner=self.admin, make=['AUDI', 'BMW'][i % 2], model='A4', year=2016, price=10000, mileage=60000,
+                    color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+            for i in range(count)
+        )
+        for vehicle in self.vehicles[-count:]:
+            VehicleImage.objects.create(vehicle=vehicle, image=ContentFile(b'image', name='car.png'))
+
+    def page_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_admin_changelist_queries_bounded(self):
+        for name in ['admin:vehicle_vehicle_changelist', 'admin:vehicle_vehicleimage_changelist']:
+            self.create_vehicles(2)
+            few = self.page_queries(reverse(name))
+            self.create_vehicles(40)
+            self.assertEqual(self.page_queries(reverse(name)), few)
+            self.assertLessEqual(few, 10)
+        filtered = reverse('admin:vehicle_vehicle_changelist') + '?year=2016&make__id__exact=1'
+        self.assertLessEqual(self.page_queries(filtered), 10)
+
+    def test_admin_reprice_and_delete_actions(self):
+        self.create_vehicles(4)
+        url = reverse('admin:vehicle_vehicle_changelist')
+        selected = [vehicle.id for vehicle in self.vehicles[:3]]
+
+        self.client.post(url, {'action': 'reprice_vehicles', '_selected_action': selected, 'percent': '-12.5'})
+        self.assertEqual(sorted(Vehicle.objects.values_list('price', flat=True)), [8750, 8750, 8750, 10000])
+        self.assertEqual(ChangeLogEntry.objects.filter(action=ChangeLogEntry.UPDATED, object_id__in=selected).count(), 3)
+
+        self.client.post(url, {'action': 'delete_vehicles', '_selected_action': selected[:2]})
+        self.assertEqual(Vehicle.objects.count(), 2)
+
+        image = VehicleImage.objects.get(vehicle_id=selected[2])
+        self.client.post(reverse('admin:vehicle_vehicleimage_changelist'),
+                         {'action': 'delete_images', '_selected_action': [image.id]})
+        self.assertEqual(Vehicle.objects.get(id=selected[2]).image_count, 0)
+
+    def test_admin_image_forms_refresh_image_fields(self):
+        self.create_vehicles(2)
+        first, second = self.vehicles
+        with open('./media/vehicle_images/test_car.png', 'rb') as img:
+            self.client.post(reverse('admin:vehicle_vehicleimage_add'), {'vehicle': first.id, 'image': img})
+        image = VehicleImage.objects.latest('id')
+        self.assertEqual(image.vehicle, first)
+        first.refresh_from_db()
+        self.assertEqual(first.image_count, 2)
+
+        change_url = reverse('admin:vehicle_vehicleimage_change', args=[image.id])
+        self.assertEqual(self.client.get(change_url).status_code, status.HTTP_200_OK)
+        self.client.post(change_url, {'vehicle': second.id})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.image_count, second.image_count), (1, 2))
+
+        self.client.post(reverse('admin:vehicle_vehicleimage_delete', args=[image.id]), {'post': 'yes'})
+        second.refresh_from_db()
+        self.assertEqual(second.image_count, 1)
+
+
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def captures(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_profile_sampled_requests(self):
+        for mode, extension in [('cprofile', '.prof'), ('sample', '.collapsed')]:
+            with self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_MODE=mode,
+                               PROFILING_SAMPLE_INTERVAL=0.0001, PROFILING_DIR=self.directory.name):
+                self.client.get(reverse('SearchVehicle'))
+            self.assertTrue(any(name.startswith('SearchVehicle-') and name.endswith(extension) for name in self.captures()))
+
+        collapsed = os.path.join(self.directory.name, 'stacks.txt')
+        output = StringIO()
+        call_command('profile_report', f'--dir={self.directory.name}', '--url-name=SearchVehicle',
+                     f'--collapsed={collapsed}', stdout=output)
+        self.assertIn('Top 20 functions of 1 captures (ms)', output.getvalue())
+        with open(collapsed) as stacks:
+            self.assertIn('get_vehicle_by_query', stacks.read())
+
+    def test_profile_capture_errors_ignored(self):
+        # A directory that can't be created, e.g. below a file
+        blocked = os.path.join(self.directory.name, 'file')
+        open(blocked, 'w').close()
+        with self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_DIR=os.path.join(blocked, 'captures')):
+            self.assertEqual(self.client.get(reverse('VehicleList')).status_code, status.HTTP_200_OK)
+
+        # Another worker removed the capture first
+        with mock.patch('os.remove', side_effect=FileNotFoundError):
+            rotate_captures(self.directory.name, 0)
+
+    def test_profile_header_requires_admin(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        token = Token.objects.create(user=user)
+        with self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.directory.name):
+            self.client.get(reverse('VehicleList'), HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual(self.captures(), [])
+
+            user.is_staff = True
+            user.save()
+            self.client.get(reverse('VehicleList'), HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual(len(self.captures()), 1)
+
+
+class ConvertDimensionsTests(TransactionTestCase):
+    # Schema changes, so the data is committed and the tables are recreated afterwards
+
+    def setUp(self):
+        baseline = Apps([])
+
+        # The vehicle tables as created by migrate --run-syncdb before the dimension tables, image fields and blobs
+        class BaselineUser(models.Model):
+            class Meta:
+                apps = baseline
+                app_label = 'baseline'
+                db_table = User._meta.db_table
+                managed = False
+
+        class BaselineVehicle(models.Model):
+            owner = models.ForeignKey(BaselineUser, on_delete=models.CASCADE)
+            make = models.CharField(max_length=50)
+            model = models.CharField(max_length=50)
+            year = models.PositiveIntegerField()
+            price = models.DecimalField(max_digits=10, decimal_places=2)
+            mileage = models.PositiveIntegerField()
+            color = models.CharField(max_length=30)
+            fuel_type = models.CharField(max_length=20)
+            transmission = models.CharField(max_length=20)
+            description = models.TextField(blank=True)
+            created_at = models.DateTimeField(auto_now_add=True)
+
+            class Meta:
+                apps = baseline
+                app_label = 'baseline'
+                db_table = Vehicle._meta.db_table
+
+        class BaselineVehicleImage(models.Model):
+            vehicle = models.ForeignKey(BaselineVehicle, on_delete=models.CASCADE)
+            image = models.CharField(max_length=100)
+            created_at = models.DateTimeField(auto_now_add=True)
+
+            class Meta:
+                apps = baseline
+                app_label = 'baseline'
+                db_table = VehicleImage._meta.db_table
+
+        self.replace_tables([VehicleImage, Vehicle], [BaselineVehicle, BaselineVehicleImage])
+        self.addCleanup(self.replace_tables, [BaselineVehicleImage, BaselineVehicle], [Vehicle, VehicleImage])
+        self.addCleanup(clear_dimension_caches)
+        self.addCleanup(cache.clear)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        vehicle = BaselineVehicle.objects.create(owner_id=self.user.pk, make='AUDI', model='A4', year=2016, price=15000,
+                                                 mileage=60000, color='SILVER', fuel_type='DIESEL', transmission='MANUAL')
+        BaselineVehicleImage.objects.create(vehicle=vehicle, image='vehicle_images/test_car.png')
+
+    def replace_tables(self, dropped, created):
+        with connection.schema_editor() as editor:
+            for model in dropped:
+                editor.delete_model(model)
+            for model in created:
+                editor.create_model(model)
+
+    def test_convert_baseline_schema(self):
+        out = StringIO()
+        call_command('convert_dimensions', stdout=out)
+        self.assertIn('Added image_count', out.getvalue())
+
+        vehicle = Vehicle.objects.get()
+        self.assertEqual([vehicle.make.name, vehicle.model.name, vehicle.color.name], ['AUDI', 'A4', 'SILVER'])
+        self.assertEqual((vehicle.owner, vehicle.year, vehicle.price), (self.user, 2016, 15000))
+        # Filled with the defaults, not with the column names
+        self.assertEqual((vehicle.image_count, vehicle.cover_image.name), (0, ''))
+        self.assertIsNone(VehicleImage.objects.get().blob)
+        # Stored before the change log, recorded so a sync from the start brings it in
+        response = self.client.get(reverse('VehicleChanges'), {'since': 0})
+        self.assertEqual([v['id'] for v in response.data['vehicles']], [vehicle.id])
+        # The count table is filled, the search counts don't start at 0
+        self.assertEqual(list(VehicleCount.objects.values_list('count', flat=True)), [1])
+
+        call_command('refresh_image_fields', stdout=StringIO())
+        vehicle.refresh_from_db()
+        self.assertEqual((vehicle.image_count, vehicle.cover_image.name), (1, 'vehicle_images/test_car.png'))
@@ -1,19 +1,41 @@
 from django.urls import path
-from .views import VehicleView, VehicleImageView, get_vehicle_makes, get_vehicle_models, get_vehicle_by_query
+from .views import (VehicleView, VehicleBulkView, VehicleImageView, SavedSearchView, get_vehicle_makes,
+                    get_vehicle_models, get_vehicle_by_query, get_vehicle_count, get_search_notifications,
+                    get_vehicle_changes, get_vehicle_snapshot, get_vehicle_batch, get_vehicle_live_feed)
 
 urlpatterns = [
     # Methods: GET (all vehicles), Post (create)
     path('', VehicleView.as_view(), name="VehicleList"),
     # Methods: GET (single vehicle), PUT (update), DELETE (remove vehicle)
     path('<int:pk>/', VehicleView.as_view(), name="VehicleDetailUpdateDelete"),
+    # Method: GET (details of many vehicles, ?ids=1,2,3)
+    path('batch/', get_vehicle_batch, name="VehicleBatch"),
+    # Methods: PUT (update many vehicles), DELETE (remove many vehicles)
+    path('bulk/', VehicleBulkView.as_view(), name="VehicleBulkUpdateDelete"),
 
     # Method: Post (create vehicle image)
     path('image/', VehicleImageView.as_view(), name="VehicleImageCreate"),
     # Method: DELETE (remove vehicle image)
     path('image/<int:pk>/', VehicleImageView.as_view(), name="VehicleImageDelete"),
 
-    # Method: Get (Search for vehicle (filter by make, model, year, price) or get vehicle make, model)
+    # Method: Get (Search for vehicle (filter by make, model, year, price, mileage) or get vehicle make, model)
     path('search/', get_vehicle_by_query, name='SearchVehicle'),
+    # Method: GET (number of search results, exact or estimated)
+    path('search/count/', get_vehicle_count, name='SearchVehicleCount'),
     path('make/', get_vehicle_makes, name='GetVehicleMakes'),
     path('model/<str:requested_make>/', get_vehicle_models, name='GetVehicleModels'),
+
+    # Method: GET (vehicles and images changed after a cursor)
+    path('changes/', get_vehicle_changes, name="VehicleChanges"),
+    # Method: GET (all vehicles page by page, with the cursor to sync from afterwards)
+    path('changes/snapshot/', get_vehicle_snapshot, name="VehicleSnapshot"),
+    # Method: GET (Server-Sent Events stream of new, updated and deleted vehicles, ASGI only)
+    path('live/', get_vehicle_live_feed, name="VehicleLiveFeed"),
+
+    # Methods: GET (own saved searches), POST (create)
+    path('saved-search/', SavedSearchView.as_view(), name="SavedSearchList"),
+    # Method: DELETE (remove saved search)
+    path('saved-search/<int:pk>/', SavedSearchView.as_view(), name="SavedSearchDelete"),
+    # Method: GET (notifications of own saved searches)
+    path('notifications/', get_search_notifications, name="SearchNotifications"),
 ]
@@ -1,11 +1,28 @@
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.decorators import permission_classes, api_view
+from rest_framework.decorators import permission_classes, api_view, throttle_classes
 from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import require_GET
+from django.conf import settings
+from decimal import Decimal, InvalidOperation
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .serializers import *
 from rest_framework import status
-from .models import Vehicle, VehicleImage
+from django.db import transaction
+from django.db.models import F, Case, When, Value, CharField
+from .models import Vehicle, VehicleImage, SavedSearch, SearchNotification, ChangeLogEntry, VehicleMake, VehicleModel
+from .dimensions import dimension_cache
+from .live import event_stream, hub, publish_vehicle_changes
+from .matching import notify_saved_searches
+from .changes import record_changes, change_log_horizon, latest_cursor
+from .fuzzy import resolve_make_and_model
+from .counting import count_vehicles
+from .catalog import (cached_vehicle_makes, cached_vehicle_models, detail_cache_key, invalidate_vehicle_details,
+                      DETAIL_CACHE_TIMEOUT)
+from django.core.cache import cache
+from api.throttling import SearchThrottle, throttles_with
 
 
 """
@@ -20,6 +37,11 @@ Anyone can get all or a single vehicle, no authentication needed for that.
 class VehicleView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @property
+    def throttle_scope(self):
+        # Only the public reads have a per route limit, the writes are limited by the user rate
+        return 'vehicles' if self.request.method == 'GET' else None
+
     def get_permissions(self):
         # Allow anyone to access the GET method
         if self.request.method == 'GET':
@@ -28,12 +50,13 @@ class VehicleView(APIView):
 
     def get(self, request, pk=None):
         if pk:
-            vehicle = get_object_or_404(Vehicle, id=pk)
-            serializer = VehicleDetailSerializer(vehicle)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            details = get_vehicle_details([pk])
+            if pk not in details:
+                raise Http404("No Vehicle matches the given query.")
+            return Response(details[pk], status=status.HTTP_200_OK)
         else:
             queryset = Vehicle.objects.all()
-            serializer = VehicleSerializer(queryset, many=True)
+            serializer = VehicleListSerializer(queryset, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
     
     def post(self, request):        
@@ -41,7 +64,10 @@ class VehicleView(APIView):
         request.data["owner"] = request.user.pk
         serializer = VehicleSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # The change log entry is written by a signal, within the same transaction
+        with transaction.atomic():
+            vehicle = serializer.save()
+            notify_saved_searches([vehicle])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def put(self, request, pk):
@@ -56,7 +82,10 @@ class VehicleView(APIView):
         serializer = VehicleSerializer(vehicle, data=request.data, partial=True)
         # If validation fails, error is automatically handled by raise_exception=True
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            if 'price' in serializer.validated_data:
+                notify_saved_searches([vehicle])
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
@@ -72,6 +101,132 @@ class VehicleView(APIView):
         return Response("Vehicle has been deleted!", status=status.HTTP_204_NO_CONTENT)
 
 
+"""
+Vehicle Batch
+=============
+
+This code returns the details of many vehicles at once (e.g. for favourites and comparison pages),
+in the requested order and with the ids that don't exist. No authentication needed.
+"""
+
+MAX_BATCH_IDS = 50
+
+def get_vehicle_details(ids):
+    """
+    Return {id: detail representation} for the existing vehicles among ids. Cached entries are reused
+    (with VEHICLE_DETAIL_CACHE), the others are loaded with two queries whatever their number (vehicles
+    with owners, then images).
+    """
+    keys = {detail_cache_key(pk): pk for pk in ids}
+    details = {}
+    if settings.VEHICLE_DETAIL_CACHE:
+        details = {keys[key]: data for key, data in cache.get_many(keys).items()}
+
+    missing = [pk for pk in ids if pk not in details]
+    if missing:
+        vehicles = Vehicle.objects.filter(id__in=missing).select_related('owner').prefetch_related('images')
+        loaded = {data['id']: data for data in VehicleDetailSerializer(vehicles, many=True).data}
+        if settings.VEHICLE_DETAIL_CACHE:
+            cache.set_many({detail_cache_key(pk): data for pk, data in loaded.items()}, DETAIL_CACHE_TIMEOUT)
+        details.update(loaded)
+
+    return details
+
+@api_view(["GET"])
+def get_vehicle_batch(request):
+    try:
+        ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+    except ValueError:
+        return Response("The ids must be a comma separated list of integers!", status=status.HTTP_400_BAD_REQUEST)
+    # Duplicates are dropped, the order is kept
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return Response("At least one id is required!", status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > MAX_BATCH_IDS:
+        return Response(f"At most {MAX_BATCH_IDS} vehicles can be requested at once!", status=status.HTTP_400_BAD_REQUEST)
+
+    details = get_vehicle_details(ids)
+    return Response({
+        "vehicles": [details[pk] for pk in ids if pk in details],
+        "missing": [pk for pk in ids if pk not in details],
+    }, status=status.HTTP_200_OK)
+
+
+"""
+Vehicle Bulk Operations
+=======================
+
+This code lets a seller update (price, mileage, description) or delete many of their own vehicles
+in a single request. Ownership is verified with one query, changes are applied in one transaction
+and the response reports the result of every requested item.
+"""
+
+class VehicleBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request):
+        items = request.data.get('vehicles') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response("A non-empty list of vehicles is required!", status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_BULK_ITEMS:
+            return Response(f"At most {MAX_BULK_ITEMS} vehicles can be updated at once!", status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every item on its own so one bad item doesn't fail the whole batch
+        results = []
+        changes = {}
+        for item in items:
+            serializer = VehicleBulkUpdateSerializer(data=item)
+            if not serializer.is_valid():
+                item_id = item.get('id') if isinstance(item, dict) else None
+                results.append({'id': item_id, 'status': 'invalid', 'errors': serializer.errors})
+                continue
+            data = dict(serializer.validated_data)
+            item_id = data.pop('id')
+            changes.setdefault(item_id, {}).update(data)
+            results.append({'id': item_id})
+
+        with transaction.atomic():
+            # Loading the vehicles filtered by owner_id is the ownership check
+            vehicles = list(
+                Vehicle.objects.select_for_update()
+                .filter(id__in=changes, owner_id=request.user.pk)
+                .only('id', 'owner_id', 'make', 'model', 'year', *BULK_UPDATE_FIELDS)
+            )
+            for vehicle in vehicles:
+                for field, value in changes[vehicle.id].items():
+                    setattr(vehicle, field, value)
+
+            fields = sorted({field for data in changes.values() for field in data})
+            if vehicles and fields:
+                # bulk_update doesn't send signals, the change log is written here
+                Vehicle.objects.bulk_update(vehicles, fields)
+                record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.UPDATED, [vehicle.id for vehicle in vehicles])
+                invalidate_vehicle_details([vehicle.id for vehicle in vehicles])
+                publish_vehicle_changes('updated', vehicles)
+
+            notify_saved_searches([vehicle for vehicle in vehicles if 'price' in changes[vehicle.id]])
+
+        updated = {vehicle.id for vehicle in vehicles}
+        for result in results:
+            if 'status' not in result:
+                result['status'] = 'updated' if result['id'] in updated else 'not_allowed'
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        serializer = VehicleBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        with transaction.atomic():
+            # Only the vehicles owned by the request user are deleted
+            owned = set(Vehicle.objects.filter(id__in=ids, owner_id=request.user.pk).values_list('id', flat=True))
+            if owned:
+                Vehicle.objects.filter(id__in=owned).delete()
+
+        results = [{'id': pk, 'status': 'deleted' if pk in owned else 'not_allowed'} for pk in dict.fromkeys(ids)]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
 """
 Vehicle Image
 =============
@@ -83,30 +238,39 @@ Only the owner is allowed to execute.
 class VehicleImageView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request):     
-        # Images can only be added to a vehicle after the vehicle has been created
-        vehicle = get_object_or_404(Vehicle, id=request.data["vehicle"])
-
-        # Apply ownership check
-        if request.user.pk != vehicle.owner.pk:
-            return Response("Not allowed!", status=status.HTTP_405_METHOD_NOT_ALLOWED)
-        
-        serializer = VehicleImageSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            # Images can only be added to a vehicle after the vehicle has been created.
+            # Lock the vehicle row so concurrent uploads can't push image_count past the limit.
+            vehicle = get_object_or_404(Vehicle.objects.select_for_update(), id=request.data["vehicle"])
+
+            # Apply ownership check
+            if request.user.pk != vehicle.owner_id:
+                return Response("Not allowed!", status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+            serializer = VehicleImageSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            vehicle_image = serializer.save()
+
+            # Keep the denormalized counter and cover image in sync, the first image becomes the cover
+            Vehicle.objects.filter(id=vehicle.id).update(
+                image_count=F('image_count') + 1,
+                cover_image=Case(When(cover_image='', then=Value(vehicle_image.image.name)), default=F('cover_image'), output_field=CharField()),
+            )
+            record_changes(ChangeLogEntry.VEHICLE, ChangeLogEntry.UPDATED, [vehicle.id])
+            invalidate_vehicle_details([vehicle.id])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, pk):
         # To proceed the request user has to be the vehicle owner
-        # Check if vehicle image exists
-        vehicle_image = get_object_or_404(VehicleImage, id=pk)
-        # Get vehicle because we need owner pk 
-        vehicle = get_object_or_404(Vehicle, id=vehicle_image.vehicle.pk)
+        # Check if vehicle image exists, the vehicle is joined because we need the owner pk
+        vehicle_image = get_object_or_404(VehicleImage.objects.select_related('vehicle'), id=pk)
 
         # Apply ownership check
-        if request.user.pk != vehicle.owner.pk:
+        if request.user.pk != vehicle_image.vehicle.owner_id:
             return Response("Not allowed!", status=status.HTTP_405_METHOD_NOT_ALLOWED)
         
-        # If the request user is the owner, allow the vehicle to be deleted
+        # If the request user is the owner, allow the vehicle image to be deleted
+        # (this locks the vehicle and recomputes its image fields, see deletion.py)
         vehicle_image.delete()
         return Response("Vehicle image has been deleted!", status=status.HTTP_204_NO_CONTENT)
 
@@ -115,46 +279,63 @@ class VehicleImageView(APIView):
 Vehicle Search
 ==============
 
-# This code helps search for vehicle makes, models, and filters by year and price.
+# This code helps search for vehicle makes, models, and filters by year, price and mileage.
 # No authentication is needed!
+# The count endpoint returns the number of matches, estimated when there are many (see counting.py).
 """
 
-@api_view(["GET"])
-def get_vehicle_by_query(request):
-    make = request.query_params.get('make', None)
-    model = request.query_params.get('model', None)
-    year = request.query_params.get('year', None)
-    price = request.query_params.get('price', None)
+def search_filters(params):
+    """The vehicle filters of the search query parameters."""
+    make = params.get('make', None)
+    model = params.get('model', None)
+    year = params.get('year', None)
+    price = params.get('price', None)
+    mileage = params.get('mileage', None)
+    filters = {}
 
-    # Start with all vehicles
-    queryset = Vehicle.objects.all()
+    # Map the make and model onto the listed names (aliases, typos), then filter on them exactly
+    makes, models = resolve_make_and_model(make, model)
 
     # Filter by make if provided
-    if make:
-        queryset = queryset.filter(make__iexact=make)
+    if makes is not None:
+        filters['make__in'] = dimension_cache(VehicleMake).find(makes)
 
     # Filter by model if provided
-    if model:
-        queryset = queryset.filter(model__iexact=model)
+    if models is not None:
+        filters['model__in'] = dimension_cache(VehicleModel).find(models)
 
     # Filter by year (from that year onwards) if provided
     if year:
-        queryset = queryset.filter(year__gte=year)
+        filters['year__gte'] = year
 
     # Filter by price (from that price onwards) if provided
     if price:
-        queryset = queryset.filter(price__gte=price)
+        filters['price__gte'] = price
+
+    # Filter by mileage (up to that mileage) if provided
+    if mileage:
+        filters['mileage__lte'] = mileage
+
+    return filters
 
-    # Finally sort by lowest price
-    queryset = queryset.order_by('price')
+@api_view(["GET"])
+@throttle_classes(throttles_with(SearchThrottle))
+def get_vehicle_by_query(request):
+    # Sort by lowest price
+    queryset = Vehicle.objects.filter(**search_filters(request.query_params)).order_by('price')
 
-    serializer = VehicleSerializer(queryset, many=True)
+    serializer = VehicleListSerializer(queryset, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+@api_view(["GET"])
+@throttle_classes(throttles_with(SearchThrottle))
+def get_vehicle_count(request):
+    count, exact = count_vehicles(search_filters(request.query_params))
+    return Response({"count": count, "exact": exact}, status=status.HTTP_200_OK)
+
 @api_view(["GET"])
 def get_vehicle_makes(request):
-    queryset = Vehicle.objects.values('make').distinct().order_by('make')
-    serializer = VehicleMakeSerializer(queryset, many=True)
+    serializer = VehicleMakeSerializer(cached_vehicle_makes(), many=True)
     
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -162,10 +343,165 @@ def get_vehicle_makes(request):
 def get_vehicle_models(request, requested_make):
     # Convert the make to uppercase since all makes are saved in uppercase.
     requested_make = requested_make.upper()
-    queryset = Vehicle.objects.filter(make=requested_make).values("model").distinct().order_by("model")
-    serializer = VehicleModelSerializer(queryset, many=True)
+    models = cached_vehicle_models(requested_make)
+    serializer = VehicleModelSerializer(models, many=True)
 
-    if not queryset.exists():
+    if not models:
         return Response("No models found for the specified make.", status=status.HTTP_404_NOT_FOUND)
     
     return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+"""
+Vehicle Changes
+===============
+
+This code lets clients synchronize incrementally: it returns the vehicles and images created, updated
+or deleted after the given cursor. A cursor older than the retained change log answers 410 Gone, this
+includes since=0 once entries have expired.
+
+The client then downloads the snapshot, page by page, and keeps the cursor of its first page. Changes
+made while paging are recorded after that cursor, syncing from it afterwards brings them in.
+"""
+
+CHANGES_PAGE_SIZE = 500
+SNAPSHOT_PAGE_SIZE = 100
+
+@api_view(["GET"])
+def get_vehicle_changes(request):
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = min(int(request.query_params.get('limit', CHANGES_PAGE_SIZE)), CHANGES_PAGE_SIZE)
+    except ValueError:
+        return Response("The since and limit parameters must be integers!", status=status.HTTP_400_BAD_REQUEST)
+    if since < 0 or limit < 1:
+        return Response("The since and limit parameters must be positive!", status=status.HTTP_400_BAD_REQUEST)
+
+    if since < change_log_horizon():
+        return Response("The cursor has expired, a full resync from the snapshot is needed!", status=status.HTTP_410_GONE)
+
+    entries = list(ChangeLogEntry.objects.filter(id__gt=since).order_by('id')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Only the latest change of every object in the page matters
+    latest = {}
+    for entry in entries:
+        latest[(entry.object_type, entry.object_id)] = entry.action
+
+    def ids(object_type, deleted):
+        return [pk for (kind, pk), action in latest.items()
+                if kind == object_type and (action == ChangeLogEntry.DELETED) == deleted]
+
+    # Objects deleted after this page are skipped here, their tombstone comes with a later page
+    vehicles = Vehicle.objects.filter(id__in=ids(ChangeLogEntry.VEHICLE, False)).prefetch_related('images').order_by('id')
+    images = VehicleImage.objects.filter(id__in=ids(ChangeLogEntry.IMAGE, False)).order_by('id')
+
+    return Response({
+        "cursor": entries[-1].id if entries else since,
+        "has_more": has_more,
+        "vehicles": VehicleSerializer(vehicles, many=True).data,
+        "images": VehicleImageSerializer(images, many=True).data,
+        "deleted": {
+            "vehicles": ids(ChangeLogEntry.VEHICLE, True),
+            "images": ids(ChangeLogEntry.IMAGE, True),
+        },
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def get_vehicle_snapshot(request):
+    try:
+        after = int(request.query_params.get('after', 0))
+        limit = min(int(request.query_params.get('limit', SNAPSHOT_PAGE_SIZE)), SNAPSHOT_PAGE_SIZE)
+    except ValueError:
+        return Response("The after and limit parameters must be integers!", status=status.HTTP_400_BAD_REQUEST)
+    if after < 0 or limit < 1:
+        return Response("The after and limit parameters must be positive!", status=status.HTTP_400_BAD_REQUEST)
+
+    # Read before the vehicles, so changes made meanwhile come after the cursor
+    cursor = latest_cursor()
+    vehicles = list(Vehicle.objects.filter(id__gt=after).prefetch_related('images').order_by('id')[:limit + 1])
+    has_more = len(vehicles) > limit
+    vehicles = vehicles[:limit]
+
+    return Response({
+        "cursor": cursor,
+        "has_more": has_more,
+        "after": vehicles[-1].id if vehicles else after,
+        "vehicles": VehicleSerializer(vehicles, many=True).data,
+    }, status=status.HTTP_200_OK)
+
+
+"""
+Vehicle Live Feed
+=================
+
+This code streams new, updated and deleted vehicles as Server-Sent Events, optionally filtered by
+make, model and price range. It is only served by the ASGI application. No authentication needed.
+"""
+
+@require_GET
+async def get_vehicle_live_feed(request):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("The live feed is only served by the ASGI application!", status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    if len(hub.subscribers) >= settings.LIVE_MAX_CLIENTS:
+        return HttpResponse("Too many live feed clients, try again later!", status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    prices = {}
+    for param in ['min_price', 'max_price']:
+        try:
+            prices[param] = Decimal(request.GET[param]) if request.GET.get(param) else None
+        except InvalidOperation:
+            return HttpResponse(f"{param} must be a number!", status=status.HTTP_400_BAD_REQUEST)
+
+    stream = event_stream(make=request.GET.get('make'), model=request.GET.get('model'), **prices)
+    # No buffering by proxies (X-Accel-Buffering is nginx's), every event has to go out right away
+    return StreamingHttpResponse(stream, content_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+"""
+Saved Searches
+==============
+
+This code lets a user save search filters (make, model, min year, min price) and read the
+notifications recorded when a matching vehicle is listed or repriced.
+"""
+
+class SavedSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        queryset = SavedSearch.objects.filter(user=request.user).order_by('-created_at')
+        serializer = SavedSearchSerializer(queryset, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        serializer = SavedSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, pk):
+        saved_search = get_object_or_404(SavedSearch, id=pk)
+
+        # Apply ownership check
+        if request.user.pk != saved_search.user_id:
+            return Response("Not allowed!", status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        saved_search.delete()
+        return Response("Saved search has been deleted!", status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_search_notifications(request):
+    queryset = (
+        SearchNotification.objects.filter(saved_search__user=request.user)
+        .select_related('vehicle')
+        .order_by('-created_at')[:100]
+    )
+    serializer = SearchNotificationSerializer(queryset, many=True)
+    return Response(serializer.data, status=status.HTTP_200_OK)